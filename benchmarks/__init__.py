@@ -0,0 +1 @@
+"""Load & performance scripts run against the local App Engine stubs."""
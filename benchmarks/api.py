@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+
+"""api.py
+
+ConferenceApi endpoints on a seeded dataset. Seeds --conferences
+conferences (with seat pools), --sessions sessions spread over them and
+--profiles profiles, each with a wishlist of --wishlist sessions and
+--attending conferences to attend, plus the speaker directory, the
+wishlist counters and the search indexes, straight into the local
+service stubs. Then calls each endpoint once with memcache flushed
+(cold) and --repeat more times (warm), recording latency, datastore &
+memcache RPCs, round-trips and entities read per call. Reads come
+first; each write call then creates, registers for or wishlists a
+fresh entity, so repeats do real work rather than fail as duplicates.
+
+Prints a JSON report; with --out, also appends it as one line to FILE
+so runs can be compared over time. --scale shrinks or grows all the
+dataset sizes at once (the full-size defaults take a while to seed).
+
+usage: python -m benchmarks.api [--conferences N] [--sessions N]
+           [--profiles N] [--wishlist N] [--attending N] [--speakers N]
+           [--scale X] [--repeat N] [--seed N] [--label TEXT]
+           [--out FILE] [--sdk PATH]
+
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import random
+import sys
+import time
+
+from benchmarks import stubs
+
+CITIES = ('London', 'Chicago', 'Tokyo', 'Paris', 'San Francisco',
+    'Berlin', 'Sydney', 'Toronto', 'Madrid', 'Seoul')
+TOPICS = ('Medical Innovations', 'Programming Languages', 'Web Technologies',
+    'Movie Making', 'Health and Nutrition', 'Robotics', 'Security', 'Data')
+SESSION_TYPES = ('lecture', 'keynote', 'workshop', 'panel', 'lab')
+PUT_BATCH_SIZE = 500
+BATCH_REGISTRATIONS = 3     # conferences per registerForConferences call
+
+
+def putAll(ndb, entities):
+    """put_multi entities in datastore-sized batches; return the keys."""
+    keys = []
+    for i in range(0, len(entities), PUT_BATCH_SIZE):
+        keys.extend(ndb.put_multi(entities[i:i + PUT_BATCH_SIZE]))
+    return keys
+
+
+def seed(args, rnd):
+    """Fill the datastore stub; return the names the calls need."""
+    from google.appengine.ext import ndb
+    import counters
+    import seats
+    import speakers
+    import textsearch
+    from conference import WISHLIST_COUNTER
+    from conference import WISHLIST_ID
+    from models import Conference
+    from models import CounterShard
+    from models import Profile
+    from models import Session
+    from models import Speaker
+    from models import Wishlist
+
+    emails = ['user%d@example.com' % i for i in range(args.profiles)]
+    organizers = emails[:max(1, args.profiles // 50)]
+    profiles = [Profile(id=email, displayName='User %d' % i,
+            mainEmail=email, teeShirtSize='NOT_SPECIFIED')
+        for i, email in enumerate(emails)]
+
+    confs = []
+    first = datetime.date(2016, 1, 1)
+    for i in range(args.conferences):
+        start = first + datetime.timedelta(days=rnd.randrange(730))
+        seats_ = rnd.choice((100, 250, 500, 1000, 2000))
+        confs.append(Conference(
+            parent=ndb.Key(Profile, organizers[i % len(organizers)]),
+            id=i + 1,
+            name='Conference %d' % i,
+            description='Seeded conference %d' % i,
+            organizerUserId=organizers[i % len(organizers)],
+            organizerDisplayName='User %d' % (i % len(organizers)),
+            topics=rnd.sample(TOPICS, rnd.randint(1, 3)),
+            city=rnd.choice(CITIES),
+            startDate=start,
+            month=start.month,
+            endDate=start + datetime.timedelta(days=2),
+            maxAttendees=seats_,
+            seatsAvailable=seats_))
+    pools = []
+    for conf in confs:
+        pools.extend(seats.createPools(conf, conf.seatsAvailable))
+    c_keys = putAll(ndb, confs + pools)[:len(confs)]
+
+    names = ['Speaker %d' % i for i in range(args.speakers)]
+    sessions = []
+    for i in range(args.sessions):
+        conf = confs[i % len(confs)]
+        sessions.append(Session(parent=conf.key,
+            name='Session %d' % i,
+            wsck=conf.key.urlsafe(),
+            highlights='Seeded session %d' % i,
+            speaker=rnd.choice(names),
+            duration='60',
+            typeOfSession=rnd.choice(SESSION_TYPES),
+            date=conf.startDate + datetime.timedelta(days=rnd.randrange(3)),
+            starttime=datetime.time(rnd.randrange(8, 19))))
+    s_keys = putAll(ndb, sessions)
+
+    bySpeaker = {}
+    for sess, s_key in zip(sessions, s_keys):
+        bySpeaker.setdefault(sess.speaker, []).append(s_key)
+    putAll(ndb, [Speaker(key=speakers.speakerKey(name), displayName=name,
+            sessionKeys=keys) for name, keys in bySpeaker.items()])
+
+    wishlists, wished = [], {}
+    for prof in profiles:
+        wssks = [key.urlsafe() for key in
+            rnd.sample(s_keys, min(args.wishlist, len(s_keys)))]
+        prof.sessionWishlist = wssks
+        prof.conferenceKeysToAttend = [key.urlsafe() for key in
+            rnd.sample(c_keys, min(args.attending, len(c_keys)))]
+        wishlists.append(Wishlist(id=WISHLIST_ID, parent=prof.key,
+            sessionKeys=wssks, counted=True))
+        for wssk in wssks:
+            wished[wssk] = wished.get(wssk, 0) + 1
+    putAll(ndb, profiles + wishlists)
+    # all of a counter in its first shard
+    putAll(ndb, [CounterShard(
+            key=counters._shardKeys(WISHLIST_COUNTER % wssk)[0], count=n)
+        for wssk, n in wished.items()])
+
+    textsearch.index(confs)
+    textsearch.index(sessions)
+
+    busiest = max(bySpeaker, key=lambda name: len(bySpeaker[name]))
+    user = profiles[-1]
+    return {
+        'user': emails[-1],
+        'organizer': organizers[0],
+        'wsck': c_keys[0].urlsafe(),
+        # what the write calls draw fresh entities from
+        'organizerWscks': [conf.key.urlsafe() for conf in confs
+            if conf.organizerUserId == organizers[0]],
+        'unattended': [key.urlsafe() for key in c_keys
+            if key.urlsafe() not in user.conferenceKeysToAttend],
+        'unwished': [key.urlsafe() for key in s_keys
+            if key.urlsafe() not in user.sessionWishlist],
+        'date': str(confs[0].startDate),
+        'city': confs[0].city,
+        'topic': confs[0].topics[0],
+        'month': str(confs[0].month),
+        'speaker': busiest,
+        'wssk': max(wished, key=wished.get) if wished else None,
+    }
+
+
+def calls(seeded):
+    """Return [(name, user email, call)] of the endpoints measured."""
+    from protorpc import message_types
+    from conference import CONF_GET_REQUEST
+    from conference import CONF_LIST_REQUEST
+    from conference import CONF_POST_REQUEST
+    from conference import FILTER_PLAYGROUND_REQUEST
+    from conference import SCHEDULE_REQUEST
+    from conference import SEARCH_REQUEST
+    from conference import SESS_INFO_REQUEST
+    from conference import SESS_LIST_REQUEST
+    from conference import SESS_SPEAK_REQUEST
+    from conference import SESS_TYPE_REQUEST
+    from conference import SPEAK_SESS_QUERY
+    from conference import SPEAKER_PREFIX_REQUEST
+    from conference import WISH_POST_REQUEST
+    from conference import ConferenceApi
+    from models import ConferenceForm
+    from models import ConferenceKeysForm
+    from models import ConferenceQueryForm
+    from models import ConferenceQueryForms
+    from models import ProfileMiniForm
+    from models import SessionForm
+    from models import SessionQueryForms
+
+    user, organizer = seeded['user'], seeded['organizer']
+    wsck = seeded['wsck']
+    void = message_types.VoidMessage()
+    conf = CONF_GET_REQUEST.combined_message_class(websafeConferenceKey=wsck)
+
+    def filters(*triples):
+        return [ConferenceQueryForm(field=field, operator=op, value=value)
+            for field, op, value in triples]
+
+    serial = itertools.count()
+    unattended = iter(seeded['unattended'])
+    unwished = iter(seeded['unwished'])
+    organizerWscks = itertools.cycle(seeded['organizerWscks'])
+
+    # a new service object per call, as endpoints makes per request, so
+    # no call is served from the one before's memo
+    return [
+        ('getConference', user, lambda: ConferenceApi().getConference(conf)),
+        ('queryConferences', user, lambda: ConferenceApi().queryConferences(
+            ConferenceQueryForms())),
+        ('queryConferences[city]', user,
+            lambda: ConferenceApi().queryConferences(
+                ConferenceQueryForms(filters=filters(
+                    ('CITY', 'EQ', seeded['city']))))),
+        ('queryConferences[topic,month]', user,
+            lambda: ConferenceApi().queryConferences(
+                ConferenceQueryForms(filters=filters(
+                    ('TOPIC', 'EQ', seeded['topic']),
+                    ('MONTH', 'EQ', seeded['month']))))),
+        ('queryConferences[city,maxAttendees]', user,
+            lambda: ConferenceApi().queryConferences(ConferenceQueryForms(
+                filters=filters(('CITY', 'NE', seeded['city']),
+                    ('MAX_ATTENDEES', 'GTEQ', '1000'))))),
+        ('getConferencesCreated', organizer,
+            lambda: ConferenceApi().getConferencesCreated(
+                CONF_LIST_REQUEST.combined_message_class())),
+        ('getConferencesToAttend', user,
+            lambda: ConferenceApi().getConferencesToAttend(void)),
+        ('getProfile', user, lambda: ConferenceApi().getProfile(void)),
+        ('getConferenceSessions', user,
+            lambda: ConferenceApi().getConferenceSessions(
+                SESS_LIST_REQUEST.combined_message_class(
+                    websafeConferenceKey=wsck))),
+        ('getConferenceSchedule', user,
+            lambda: ConferenceApi().getConferenceSchedule(
+                SCHEDULE_REQUEST.combined_message_class(
+                    websafeConferenceKey=wsck, date=seeded['date']))),
+        ('getConferenceSessionsByType', user,
+            lambda: ConferenceApi().getConferenceSessionsByType(
+                SESS_TYPE_REQUEST.combined_message_class(
+                    websafeConferenceKey=wsck, typeOfSession='lecture'))),
+        ('querySessions[type]', user, lambda: ConferenceApi().querySessions(
+            SessionQueryForms(filters=filters(('TYPE', 'EQ', 'workshop'))))),
+        ('getSessionsBySpeaker', user,
+            lambda: ConferenceApi().getSessionsBySpeaker(
+                SESS_SPEAK_REQUEST.combined_message_class(
+                    speaker=seeded['speaker']))),
+        ('getFeaturedSpeaker', user,
+            lambda: ConferenceApi().getFeaturedSpeaker(conf)),
+        ('getSessionsInWishlist', user,
+            lambda: ConferenceApi().getSessionsInWishlist(void)),
+        ('numWishConfsQuery', user, lambda: ConferenceApi().numWishConfsQuery(
+            SESS_INFO_REQUEST.combined_message_class(wssk=seeded['wssk']))),
+        ('getWishlistConflicts', user,
+            lambda: ConferenceApi().getWishlistConflicts(void)),
+        ('getAnnouncement', user,
+            lambda: ConferenceApi().getAnnouncement(void)),
+        ('searchConferences', user, lambda: ConferenceApi().searchConferences(
+            SEARCH_REQUEST.combined_message_class(query=seeded['city']))),
+        ('searchSessions', user, lambda: ConferenceApi().searchSessions(
+            SEARCH_REQUEST.combined_message_class(query='workshop'))),
+        ('searchSpeakers', user, lambda: ConferenceApi().searchSpeakers(
+            SPEAKER_PREFIX_REQUEST.combined_message_class(
+                prefix='Speaker 1'))),
+        ('filterPlayground', user, lambda: ConferenceApi().filterPlayground(
+            FILTER_PLAYGROUND_REQUEST.combined_message_class())),
+        ('speakerSessQuery', user, lambda: ConferenceApi().speakerSessQuery(
+            SPEAK_SESS_QUERY.combined_message_class(
+                speaker=seeded['speaker'], sessionType='lecture'))),
+
+        # writes, each on a fresh entity
+        ('createConference', user, lambda: ConferenceApi().createConference(
+            ConferenceForm(name='New Conference %d' % next(serial),
+                city=seeded['city'], maxAttendees=100))),
+        ('updateConference', organizer,
+            lambda: ConferenceApi().updateConference(
+                CONF_POST_REQUEST.combined_message_class(
+                    websafeConferenceKey=next(organizerWscks),
+                    description='Updated %d' % next(serial)))),
+        ('createSession', organizer, lambda: ConferenceApi().createSession(
+            SessionForm(name='New Session %d' % next(serial), wsck=wsck,
+                speaker=seeded['speaker'], typeOfSession='lecture',
+                duration='60', date=seeded['date'], starttime='10:00'))),
+        ('saveProfile', user, lambda: ConferenceApi().saveProfile(
+            ProfileMiniForm(displayName='Renamed %d' % next(serial)))),
+        ('registerForConference', user,
+            lambda: ConferenceApi().registerForConference(
+                CONF_GET_REQUEST.combined_message_class(
+                    websafeConferenceKey=next(unattended)))),
+        ('registerForConferences', user,
+            lambda: ConferenceApi().registerForConferences(ConferenceKeysForm(
+                websafeConferenceKeys=[next(unattended)
+                    for i in range(BATCH_REGISTRATIONS)]))),
+        ('addSessionToWishlist', user,
+            lambda: ConferenceApi().addSessionToWishlist(
+                WISH_POST_REQUEST.combined_message_class(
+                    sessionKeys=next(unwished)))),
+    ]
+
+
+def run(name, call):
+    """Make one measured call; return its {ms, calls, roundTrips,
+    entities}."""
+    import rpcstats
+    rpcstats.reset()
+    start = time.time()
+    rpcstats.measure(name, call)
+    ms = (time.time() - start) * 1000
+    total = rpcstats.totals()[name]
+    return {'ms': ms, 'calls': total['calls'],
+        'roundTrips': total['roundTrips'], 'entities': total['entities']}
+
+
+def summarize(runs):
+    """Reduce warm runs to latency percentiles & mean RPC counts."""
+    ms = sorted(run['ms'] for run in runs)
+    mean = lambda field: round(sum(run[field] for run in runs) /
+        float(len(runs)), 2)
+    return {
+        'runs': len(runs),
+        'msMin': round(ms[0], 3),
+        'msMedian': round(ms[len(ms) // 2], 3),
+        'msP95': round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 3),
+        'calls': mean('calls'),
+        'roundTrips': mean('roundTrips'),
+        'entities': mean('entities'),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='ConferenceApi latency & RPCs on a seeded dataset.')
+    parser.add_argument('--conferences', type=int, default=10000)
+    parser.add_argument('--sessions', type=int, default=100000)
+    parser.add_argument('--profiles', type=int, default=50000)
+    parser.add_argument('--wishlist', type=int, default=10)
+    parser.add_argument('--attending', type=int, default=3)
+    parser.add_argument('--speakers', type=int, default=2000)
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--label', default='')
+    parser.add_argument('--out')
+    parser.add_argument('--sdk', default=stubs.DEFAULT_SDK)
+    args = parser.parse_args(argv)
+    for size in ('conferences', 'sessions', 'profiles', 'speakers'):
+        setattr(args, size, max(1, int(getattr(args, size) * args.scale)))
+    # the registration & wishlist writes each need fresh entities
+    perCall = args.repeat + 1
+    needed = args.attending + perCall * (1 + BATCH_REGISTRATIONS)
+    if args.conferences < needed:
+        parser.error('need at least %d conferences for --repeat %d' % (
+            needed, args.repeat))
+    if args.sessions < args.wishlist + perCall:
+        parser.error('need at least %d sessions for --repeat %d' % (
+            args.wishlist + perCall, args.repeat))
+    stubs.setup(args.sdk)
+
+    from google.appengine.api import memcache
+
+    start = time.time()
+    seeded = seed(args, random.Random(args.seed))
+    seconds = time.time() - start
+
+    results = {}
+    for name, email, call in calls(seeded):
+        stubs.signIn(email)
+        memcache.flush_all()
+        cold = run(name, call)
+        cold['ms'] = round(cold['ms'], 3)
+        warm = [run(name, call) for i in range(args.repeat)]
+        results[name] = {'cold': cold, 'warm': summarize(warm) if warm else None}
+
+    report = {
+        'label': args.label,
+        'at': datetime.datetime.utcnow().isoformat(),
+        'dataset': dict((size, getattr(args, size)) for size in (
+            'conferences', 'sessions', 'profiles', 'wishlist', 'attending',
+            'speakers', 'seed')),
+        'seedSeconds': round(seconds, 1),
+        'repeat': args.repeat,
+        'results': results,
+    }
+    print(json.dumps(report, indent=2, sort_keys=True))
+    if args.out:
+        with open(args.out, 'a') as f:
+            f.write(json.dumps(report, sort_keys=True) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
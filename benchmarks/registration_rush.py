@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+"""registration_rush.py
+
+A ticket drop: many users hitting registerForConference on one
+conference at the same moment. Signs up --users distinct users, then
+releases them all at once from --threads threads through
+_conferenceRegistration against the local datastore stub; with
+--cancel, that share of the successful registrants unregister again
+straight away, handing their seats back mid-rush.
+
+Reports throughput, latency percentiles, outcomes by exception (a
+failed cancel counts as cancelFailed, its user as still registered),
+transaction begins, commits, rollbacks & retries, and checks the
+no-oversell guarantee at the end: every registration is on a Profile,
+the registered users plus the free seats left in the pools equal
+maxAttendees, and the rolled-up Conference.seatsAvailable agrees with
+the pools. Prints a JSON report; exits 1 if a check fails.
+
+usage: python -m benchmarks.registration_rush [--users N] [--seats N]
+           [--threads N] [--cancel X] [--seed N] [--sdk PATH]
+
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+
+from benchmarks import stubs
+
+
+def percentile(values, pct):
+    """Return the pct-th percentile of sorted values (None if empty)."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Many registrants racing for one conference.')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--seats', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=20)
+    parser.add_argument('--cancel', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--sdk', default=stubs.DEFAULT_SDK)
+    args = parser.parse_args(argv)
+    stubs.setup(args.sdk)
+
+    # these need the SDK on sys.path, so import them after setup()
+    import rpcstats
+    import seats
+    from conference import CONF_GET_REQUEST
+    from conference import ConferenceApi
+    from models import Conference
+    from models import ConferenceForm
+    from models import ConflictException
+    from models import Profile
+
+    stubs.signIn('organizer@example.com')
+    ConferenceApi()._createConferenceObject(
+        ConferenceForm(name='Hot Conference', maxAttendees=args.seats))
+    conf = Conference.query().get()
+    wsck = conf.key.urlsafe()
+    request = CONF_GET_REQUEST.combined_message_class(websafeConferenceKey=wsck)
+
+    # sign-up isn't part of the rush
+    for i in range(args.users):
+        stubs.signIn('user%d@example.com' % i)
+        ConferenceApi()._getProfileFromUser()
+
+    @rpcstats.measured
+    def register():
+        return ConferenceApi()._conferenceRegistration(request)
+
+    @rpcstats.measured
+    def unregister():
+        return ConferenceApi()._conferenceRegistration(request, reg=False)
+
+    rnd = random.Random(args.seed)
+    lock = threading.Lock()
+    go = threading.Event()
+    pending = list(range(args.users))
+    rnd.shuffle(pending)
+    outcome = {'registered': 0, 'soldOut': 0, 'unregistered': 0,
+        'cancelFailed': 0}
+    errors = {}
+    latencies = []
+
+    def attempt(call):
+        """Make one call; return its outcome name."""
+        start = time.time()
+        try:
+            call()
+            result = None
+        except ConflictException:
+            result = 'soldOut'
+        except Exception as e:
+            result = type(e).__name__
+        with lock:
+            latencies.append((time.time() - start) * 1000)
+        return result
+
+    def worker():
+        go.wait()
+        while True:
+            with lock:
+                if not pending:
+                    return
+                i = pending.pop()
+                cancel = rnd.random() < args.cancel
+            stubs.signIn('user%d@example.com' % i)
+            result = attempt(register) or 'registered'
+            if result == 'registered' and cancel:
+                # a failed cancel leaves the user registered, whatever
+                # the exception (even a ConflictException)
+                result = 'unregistered' if attempt(unregister) is None \
+                    else 'cancelFailed'
+                if result == 'cancelFailed':
+                    with lock:
+                        outcome['registered'] += 1
+            with lock:
+                if result in outcome:
+                    outcome[result] += 1
+                else:
+                    errors[result] = errors.get(result, 0) + 1
+
+    threads = [threading.Thread(target=worker) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    start = time.time()
+    go.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    attendees = Profile.query(Profile.conferenceKeysToAttend == wsck).count()
+    free = seats.available(Conference.query().get())
+    seats.sync(conf.key)
+    rolledUp = conf.key.get().seatsAvailable
+    totals = rpcstats.totals()
+    byMethod = {}
+    for name in ('register', 'unregister'):
+        for method, count in totals.get(name, {}).get('byMethod', {}).items():
+            byMethod[method] = byMethod.get(method, 0) + count
+    begins = byMethod.get('datastore_v3.BeginTransaction', 0)
+    commits = byMethod.get('datastore_v3.Commit', 0)
+    done = outcome['registered'] + 2 * outcome['unregistered']
+    latencies.sort()
+    checks = {
+        'profilesMatch': attendees == outcome['registered'],
+        'noOversell': attendees + free == args.seats,
+        'rollUpMatches': rolledUp == free,
+    }
+    report = dict(outcome,
+        users=args.users,
+        seats=args.seats,
+        threads=args.threads,
+        cancel=args.cancel,
+        pools=conf.seatShards,
+        errors=errors,
+        seconds=round(elapsed, 3),
+        perSecond=round(len(latencies) / elapsed, 1) if elapsed else None,
+        latencyMs=dict(('p%d' % pct, round(percentile(latencies, pct), 2))
+            for pct in (50, 95, 99)) if latencies else None,
+        maxLatencyMs=round(latencies[-1], 2) if latencies else None,
+        transactions={
+            'begun': begins,
+            'commits': commits,
+            'rollbacks': byMethod.get('datastore_v3.Rollback', 0),
+            # a successful (un)registration, sold-out answer or failed
+            # cancel takes one transaction; every other one began was a
+            # retry
+            'retries': max(0, begins - done - outcome['soldOut'] -
+                outcome['cancelFailed']),
+        },
+        attendees=attendees,
+        freeSeats=free,
+        seatsAvailable=rolledUp,
+        checks=checks,
+        consistent=all(checks.values()),
+    )
+    print(json.dumps(report, indent=2, sort_keys=True))
+    return 0 if report['consistent'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""serializers.py
+
+Micro-benchmark of the precompiled Serializer plans against the per-row
+reflection the _copy*ToForm methods used before. Copies --rows in-memory
+entities per round, best of --rounds, and prints a JSON report.
+
+usage: python -m benchmarks.serializers [--rows N] [--rounds N] [--sdk PATH]
+
+"""
+
+import argparse
+import datetime
+import json
+import sys
+import timeit
+
+from benchmarks import stubs
+
+
+def reflectiveCopy(entity, message):
+    """The former _copyConferenceToForm/_copySessionToForm loop."""
+    form = message()
+    for field in form.all_fields():
+        if hasattr(entity, field.name):
+            if field.name.endswith('Date') or field.name.endswith('date') \
+                    or field.name.endswith('starttime'):
+                setattr(form, field.name, str(getattr(entity, field.name)))
+            else:
+                setattr(form, field.name, getattr(entity, field.name))
+        elif field.name == 'websafeKey':
+            setattr(form, field.name, entity.key.urlsafe())
+    form.check_initialized()
+    return form
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Serializer plans vs. per-row reflection.')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--sdk', default=stubs.DEFAULT_SDK)
+    args = parser.parse_args(argv)
+    stubs.setup(args.sdk)
+
+    from google.appengine.ext import ndb
+    import conference
+    from models import Conference
+    from models import ConferenceForm
+    from models import Profile
+    from models import Session
+    from models import SessionForm
+
+    p_key = ndb.Key(Profile, 'organizer@example.com')
+    confs = [Conference(key=ndb.Key(Conference, i + 1, parent=p_key),
+            name='Conference %d' % i,
+            description='A conference ' * 20,
+            organizerUserId='organizer@example.com',
+            topics=['Web', 'Programming'],
+            city='London',
+            startDate=datetime.date(2016, 6, 1),
+            endDate=datetime.date(2016, 6, 3),
+            month=6,
+            maxAttendees=100,
+            seatsAvailable=42)
+        for i in range(args.rows)]
+    sessions = [Session(key=ndb.Key(Session, i + 1, parent=confs[0].key),
+            name='Session %d' % i,
+            wsck=confs[0].key.urlsafe(),
+            highlights='Highlights ' * 20,
+            speaker='Jane Doe',
+            duration='60',
+            typeOfSession='lecture',
+            date=datetime.date(2016, 6, 1),
+            starttime=datetime.time(14, 0))
+        for i in range(args.rows)]
+
+    cases = [
+        ('Conference', confs, ConferenceForm, conference.CONFERENCE_SERIALIZER),
+        ('Session', sessions, SessionForm, conference.SESSION_SERIALIZER),
+    ]
+    report = {'rows': args.rows, 'rounds': args.rounds}
+    for name, entities, message, serializer in cases:
+        reflective = min(timeit.repeat(
+            lambda: [reflectiveCopy(e, message) for e in entities],
+            number=1, repeat=args.rounds))
+        planned = min(timeit.repeat(
+            lambda: serializer.many(entities),
+            number=1, repeat=args.rounds))
+        report[name] = {
+            'reflectiveMs': round(reflective * 1000, 2),
+            'plannedMs': round(planned * 1000, 2),
+            'speedup': round(reflective / planned, 2) if planned else None,
+        }
+    print(json.dumps(report, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+"""stubs.py
+
+Local App Engine service stubs for the benchmark scripts. Run the
+scripts from the repository root with the App Engine SDK at hand:
+
+    python -m benchmarks.registration_rush --sdk ~/google_appengine
+
+"""
+
+import os
+import sys
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SDK = os.environ.get('APPENGINE_SDK', '/usr/local/google_appengine')
+
+_user = threading.local()
+
+
+def setup(sdk=DEFAULT_SDK):
+    """Put the SDK on sys.path & activate the service stubs the app
+    uses; return the active testbed."""
+    if sdk not in sys.path:
+        sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+
+    tb = testbed.Testbed()
+    tb.activate()
+    # strongly consistent, so the scripts can check their results
+    # with plain queries
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1)
+    tb.init_datastore_v3_stub(consistency_policy=policy)
+    tb.init_memcache_stub()
+    tb.init_search_stub()
+    tb.init_taskqueue_stub(root_path=ROOT)
+    tb.init_urlfetch_stub()
+    tb.init_mail_stub()
+    tb.init_app_identity_stub()
+    tb.init_user_stub()
+
+    # endpoints normally gets the user from the request's auth header;
+    # here each simulated client thread signs in with signIn()
+    import endpoints
+    endpoints.get_current_user = lambda: getattr(_user, 'current', None)
+    return tb
+
+
+def signIn(email):
+    """Make endpoints.get_current_user() return email's user on the
+    calling thread."""
+    from google.appengine.api import users
+    _user.current = users.User(email=email, _auth_domain='gmail.com')
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+"""tokeninfo.py
+
+OAuth token -> user id resolution in getUserId(id_type="oauth")
+against a local fake tokeninfo server that answers after --latency ms.
+Replays --requests bearer tokens, drawn with a skewed (Zipf-like)
+popularity from --tokens valid tokens plus a --invalid share of
+rejected ones, three times:
+
+  uncached      every request asks tokeninfo, as before the cache
+  cached        one instance, starting with empty LRU & memcache
+  newInstance   empty LRU but memcache kept, like a fresh instance
+
+and prints a JSON report of latency, tokeninfo fetches and hits per
+cache tier for each. The tiers are TokenCache.stats: local and
+memcache hits (negativeHits of them cached invalid tokens), and
+tokeninfo lookups that were fetched (valid), invalid or unreachable.
+
+usage: python -m benchmarks.tokeninfo [--requests N] [--tokens N]
+           [--invalid X] [--latency MS] [--expires S] [--seed N]
+           [--sdk PATH]
+
+"""
+
+import argparse
+import BaseHTTPServer
+import bisect
+import json
+import os
+import random
+import SocketServer
+import sys
+import threading
+import time
+import urlparse
+
+from benchmarks import stubs
+
+
+class FakeTokenInfo(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """FakeTokenInfo -- answers tokeninfo requests: "valid-N" tokens
+    belong to user N, anything else is an invalid_token"""
+    daemon_threads = True
+
+    def __init__(self, latency, expires):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+            FakeTokenInfoHandler)
+        self.latency = latency
+        self.expires = expires
+        self.requests = 0
+
+
+class FakeTokenInfoHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests += 1
+        time.sleep(self.server.latency / 1000.0)
+        query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+        token = (query.get('id_token') or query.get('access_token') or [''])[0]
+        if token.startswith('valid-'):
+            status, body = 200, {'user_id': token[len('valid-'):],
+                'expires_in': self.server.expires}
+        else:
+            status, body = 400, {'error': 'invalid_token'}
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(body))
+
+    def log_message(self, *args):
+        pass
+
+
+def workload(args, rnd):
+    """Return the list of tokens to replay."""
+    weights = [1.0 / (i + 1) for i in range(args.tokens)]
+    cumulative = []
+    total = 0.0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    tokens = []
+    for i in range(args.requests):
+        if rnd.random() < args.invalid:
+            tokens.append('bad-%d' % rnd.randrange(10))
+        else:
+            n = bisect.bisect_left(cumulative, rnd.random() * total)
+            tokens.append('valid-%d' % n)
+    return tokens
+
+
+def replay(server, tokens, resolve):
+    """Resolve every token; return latency & fetch numbers."""
+    before = server.requests
+    ms = []
+    for token in tokens:
+        start = time.time()
+        resolve(token)
+        ms.append((time.time() - start) * 1000)
+    ms.sort()
+    return {
+        'requests': len(tokens),
+        'fetches': server.requests - before,
+        'msMean': round(sum(ms) / len(ms), 3),
+        'msMedian': round(ms[len(ms) // 2], 3),
+        'msP95': round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='getUserId OAuth token cache vs. a fake tokeninfo.')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--tokens', type=int, default=200)
+    parser.add_argument('--invalid', type=float, default=0.05)
+    parser.add_argument('--latency', type=float, default=50)
+    parser.add_argument('--expires', type=int, default=3600)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--sdk', default=stubs.DEFAULT_SDK)
+    args = parser.parse_args(argv)
+    stubs.setup(args.sdk)
+
+    from google.appengine.api import memcache
+    import settings
+    import utils
+
+    server = FakeTokenInfo(args.latency, args.expires)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    settings.TOKENINFO_URL = 'http://127.0.0.1:%d/tokeninfo' % \
+        server.server_address[1]
+
+    def viaGetUserId(token):
+        os.environ['HTTP_AUTHORIZATION'] = 'Bearer %s' % token
+        return utils.getUserId(None, id_type='oauth')
+
+    tokens = workload(args, random.Random(args.seed))
+    results = {}
+    results['uncached'] = replay(server, tokens,
+        lambda token: utils._fetchTokenInfo(token, 'id_token'))
+    utils.tokenCache.clear()
+    memcache.flush_all()
+    results['cached'] = replay(server, tokens, viaGetUserId)
+    results['cached']['tiers'] = dict(utils.tokenCache.stats)
+    utils.tokenCache.clear()
+    results['newInstance'] = replay(server, tokens, viaGetUserId)
+    results['newInstance']['tiers'] = dict(utils.tokenCache.stats)
+    server.shutdown()
+
+    report = {
+        'requests': args.requests,
+        'tokens': args.tokens,
+        'invalid': args.invalid,
+        'latencyMs': args.latency,
+        'distinctTokens': len(set(tokens)),
+        'results': results,
+    }
+    print(json.dumps(report, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
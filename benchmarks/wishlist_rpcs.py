@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""wishlist_rpcs.py
+
+RPCs made by the wishlist endpoints as the wishlist grows. For each
+--sizes N, fills a fresh wishlist with N - 1 sessions, then adds one
+more via addSessionToWishlist, adds a batch via addSessionsToWishlist
+and removes that batch via removeSessionsFromWishlist, counting the
+datastore & memcache RPCs and round-trips of each call. Prints a JSON
+report; the counts should not grow with N.
+
+usage: python -m benchmarks.wishlist_rpcs [--sizes N,N,...] [--batch N]
+           [--sdk PATH]
+
+"""
+
+import argparse
+import json
+import sys
+
+from benchmarks import stubs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Wishlist endpoint RPCs by wishlist size.')
+    parser.add_argument('--sizes', default='1,10,25,50,100')
+    parser.add_argument('--batch', type=int, default=10)
+    parser.add_argument('--sdk', default=stubs.DEFAULT_SDK)
+    args = parser.parse_args(argv)
+    stubs.setup(args.sdk)
+
+    from google.appengine.ext import ndb
+    import rpcstats
+    from conference import WISH_POST_REQUEST
+    from conference import ConferenceApi
+    from models import Conference
+    from models import ConferenceForm
+    from models import Session
+    from models import WishlistForm
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    stubs.signIn('organizer@example.com')
+    api = ConferenceApi()
+    api._createConferenceObject(ConferenceForm(name='Big Conference'))
+    c_key = Conference.query().get().key
+    s_keys = ndb.put_multi([Session(parent=c_key,
+            name='Session %d' % i,
+            wsck=c_key.urlsafe(),
+            speaker='Speaker %d' % (i % 7))
+        for i in range(max(sizes) + args.batch)])
+    wssks = [key.urlsafe() for key in s_keys]
+
+    # a new service object per measured call, as endpoints makes per
+    # request, so no call is served from the one before's memo
+    calls = {
+        'addSessionToWishlist': lambda wssks:
+            ConferenceApi().addSessionToWishlist(
+                WISH_POST_REQUEST.combined_message_class(
+                    sessionKeys=wssks[0])),
+        'addSessionsToWishlist': lambda wssks:
+            ConferenceApi().addSessionsToWishlist(
+                WishlistForm(sessionKeys=wssks)),
+        'removeSessionsFromWishlist': lambda wssks:
+            ConferenceApi().removeSessionsFromWishlist(
+                WishlistForm(sessionKeys=wssks)),
+    }
+
+    def measure(name, wssks):
+        rpcstats.reset()
+        rpcstats.measured(lambda: calls[name](wssks))()
+        total = rpcstats.totals()['<lambda>']
+        return {'calls': total['calls'], 'roundTrips': total['roundTrips']}
+
+    rows = []
+    for i, size in enumerate(sizes):
+        # a new user per size starts with an empty wishlist
+        stubs.signIn('user%d@example.com' % i)
+        api._getProfileFromUser()
+        # wishlists are created on first use; not part of the counts
+        api._getUserWishlist()
+        filler = wssks[:size - 1]
+        for start in range(0, len(filler), args.batch):
+            api.addSessionsToWishlist(
+                WishlistForm(sessionKeys=filler[start:start + args.batch]))
+        batch = wssks[size:size + args.batch]
+        rows.append({
+            'wishlistSize': size,
+            'addSessionToWishlist':
+                measure('addSessionToWishlist', wssks[size - 1:size]),
+            'addSessionsToWishlist': measure('addSessionsToWishlist', batch),
+            'removeSessionsFromWishlist':
+                measure('removeSessionsFromWishlist', batch),
+        })
+
+    print(json.dumps({'batch': args.batch, 'results': rows},
+        indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+
+"""confcache.py
+
+Udacity conference server-side Python App Engine getConference &
+queryConferences cache
+
+Serialized ConferenceForms are kept in memcache under a key that embeds
+two version numbers: the conference's and its organizer's. Writers bump
+a version only after their datastore write has committed, so a reader
+that loaded the old entity can only store it under the old version,
+which nobody reads any more. Nothing stale outlives a committed write.
+
+A version that is missing from memcache (never set, or evicted) is
+re-seeded with a random value rather than 0, so it cannot collide with
+forms cached under the version it replaces.
+
+Pages of queryConferences results are cached the same way, keyed by a
+canonical form of the query (filters sorted & deduplicated, values
+already coerced to property types) and one generation number that
+every conference or organizer change bumps.  Queries outside an
+entity group are eventually consistent, so for QUERY_SETTLE_SECONDS
+after a bump a fill may still read the old indexes; pages filled in
+that window are kept for QUERY_SETTLE_TTL only.
+
+"""
+
+import hashlib
+import random
+import threading
+import time
+
+from protorpc import protobuf
+
+from google.appengine.api import memcache
+
+from models import ConferenceForm
+from models import ConferenceForms
+
+CONF_VERSION_KEY = 'CONF_VERSION_%s'
+ORGANIZER_VERSION_KEY = 'ORGANIZER_VERSION_%s'
+FORM_KEY = 'CONF_FORM_%s_%d_%d'
+FORM_TTL = 60 * 60
+HITS_KEY = 'CONF_CACHE_HITS'
+MISSES_KEY = 'CONF_CACHE_MISSES'
+QUERY_GENERATION_KEY = 'CONF_QUERY_GENERATION'
+QUERY_CHANGED_KEY = 'CONF_QUERY_CHANGED'
+QUERY_SETTLE_SECONDS = 30
+QUERY_SETTLE_TTL = 5
+QUERY_KEY = 'CONF_QUERY_%d_%s'
+QUERY_TTL = 10 * 60
+QUERY_HITS_KEY = 'CONF_QUERY_CACHE_HITS'
+QUERY_MISSES_KEY = 'CONF_QUERY_CACHE_MISSES'
+STATS_FLUSH_EVERY = 50
+
+_lock = threading.Lock()
+_unflushed = {HITS_KEY: 0, MISSES_KEY: 0, QUERY_HITS_KEY: 0, QUERY_MISSES_KEY: 0}
+
+
+def _count(name):
+    """Count a hit or miss; flush the instance's counts to memcache in
+    batches to keep the overhead off most requests."""
+    with _lock:
+        _unflushed[name] += 1
+        if sum(_unflushed.values()) < STATS_FLUSH_EVERY:
+            return
+        deltas = dict(_unflushed)
+        for key in _unflushed:
+            _unflushed[key] = 0
+    memcache.offset_multi(deltas, initial_value=0)
+
+
+def _versions(c_key):
+    """Return (conference version, organizer version), seeding any
+    missing one; None if memcache is unavailable."""
+    keys = [CONF_VERSION_KEY % c_key.urlsafe(),
+        ORGANIZER_VERSION_KEY % c_key.parent().id()]
+    versions = memcache.get_multi(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # add() keeps whichever seed got there first
+        memcache.add_multi(dict((key, random.getrandbits(32)) for key in missing))
+        versions.update(memcache.get_multi(missing))
+        if len(versions) < len(keys):
+            return None
+    return tuple(versions[key] for key in keys)
+
+
+def get(c_key):
+    """Look up the cached ConferenceForm of Conference c_key.
+
+    Returns (form, slot): form is None on a miss, in which case the
+    caller should build the form and hand it to put() with slot.
+    """
+    versions = _versions(c_key)
+    if versions is None:
+        _count(MISSES_KEY)
+        return None, None
+    slot = FORM_KEY % ((c_key.urlsafe(),) + versions)
+    data = memcache.get(slot)
+    if data is None:
+        _count(MISSES_KEY)
+        return None, slot
+    _count(HITS_KEY)
+    return protobuf.decode_message(ConferenceForm, data), slot
+
+
+def put(slot, form):
+    """Cache form in the slot returned by a get() miss."""
+    if slot:
+        memcache.set(slot, protobuf.encode_message(form), time=FORM_TTL)
+
+
+def conferenceChanged(c_key):
+    """Invalidate the cached form of Conference c_key and all cached
+    query results; call after the write has committed."""
+    # a missing key stays missing, which _versions() treats as changed
+    memcache.set(QUERY_CHANGED_KEY, time.time())
+    memcache.offset_multi({CONF_VERSION_KEY % c_key.urlsafe(): 1,
+        QUERY_GENERATION_KEY: 1})
+
+
+def organizerChanged(user_id):
+    """Invalidate the cached forms of all conferences organized by
+    user_id and all cached query results; call after the Profile write
+    has committed."""
+    memcache.set(QUERY_CHANGED_KEY, time.time())
+    memcache.offset_multi({ORGANIZER_VERSION_KEY % user_id: 1,
+        QUERY_GENERATION_KEY: 1})
+
+
+def queriesChanged():
+    """Invalidate all cached query results, e.g. after a new conference
+    or a seat roll-up; call after the write has committed."""
+    memcache.set(QUERY_CHANGED_KEY, time.time())
+    memcache.incr(QUERY_GENERATION_KEY)
+
+
+def _generation():
+    """Return (query generation, time of the last change or None),
+    seeding the generation if missing; (None, None) if memcache is
+    unavailable."""
+    # the change time is set before the bump, so a reader of the new
+    # generation always sees its change time
+    values = memcache.get_multi([QUERY_GENERATION_KEY, QUERY_CHANGED_KEY])
+    generation = values.get(QUERY_GENERATION_KEY)
+    if generation is None:
+        memcache.add(QUERY_GENERATION_KEY, random.getrandbits(32))
+        generation = memcache.get(QUERY_GENERATION_KEY)
+    return generation, values.get(QUERY_CHANGED_KEY)
+
+
+def _canonical(predicates, pageSize, cursor, fields):
+    """Return a digest that is the same for equivalent queries."""
+    terms = set()
+    for pred in predicates:
+        value = tuple(sorted(set(pred.value))) if pred.op == 'IN' else pred.value
+        terms.add((pred.field, pred.op, value))
+    fields = sorted(fields) if fields is not None else None
+    return hashlib.sha1(
+        repr((sorted(terms), pageSize, cursor, fields))).hexdigest()
+
+
+def getQuery(predicates, pageSize, cursor, fields=None):
+    """Look up a cached page of queryConferences results; predicates
+    are the query's planner Predicates, cursor the request's websafe
+    cursor or None, fields its field mask or None.
+
+    Returns (forms, slot) like get().
+    """
+    generation, changed = _generation()
+    if generation is None:
+        _count(QUERY_MISSES_KEY)
+        return None, None
+    key = QUERY_KEY % (generation,
+        _canonical(predicates, pageSize, cursor, fields))
+    settling = changed is not None and \
+        time.time() - changed < QUERY_SETTLE_SECONDS
+    slot = (key, QUERY_SETTLE_TTL if settling else QUERY_TTL)
+    data = memcache.get(key)
+    if data is None:
+        _count(QUERY_MISSES_KEY)
+        return None, slot
+    _count(QUERY_HITS_KEY)
+    return protobuf.decode_message(ConferenceForms, data), slot
+
+
+def putQuery(slot, forms):
+    """Cache forms in the slot returned by a getQuery() miss."""
+    if slot:
+        key, ttl = slot
+        memcache.set(key, protobuf.encode_message(forms), time=ttl)
+
+
+def stats():
+    """Return cache hit/miss totals across all instances."""
+    keys = [HITS_KEY, MISSES_KEY, QUERY_HITS_KEY, QUERY_MISSES_KEY]
+    totals = memcache.get_multi(keys)
+    with _lock:
+        counts = [totals.get(key, 0) + _unflushed[key] for key in keys]
+    hits, misses, query_hits, query_misses = counts
+    rate = lambda hits, misses: \
+        round(float(hits) / (hits + misses), 4) if hits + misses else None
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hitRate': rate(hits, misses),
+        'queryHits': query_hits,
+        'queryMisses': query_misses,
+        'queryHitRate': rate(query_hits, query_misses),
+    }
@@ -20,7 +20,9 @@ from protorpc import messages
 from protorpc import message_types
 from protorpc import remote
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
+from google.appengine.api import search
 from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
 
@@ -32,24 +34,56 @@ from models import BooleanMessage
 from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
+from models import ConferenceKeysForm
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import RegistrationResultForm
+from models import RegistrationResultForms
 from models import TeeShirtSize
 from models import StringMessage
 from models import Session
 from models import SessionForm
+from models import SessionConflictForm
+from models import SessionConflictForms
 from models import SessionForms
+from models import SessionQueryForms
+from models import SeatShard
+from models import SpeakerForm
+from models import SpeakerForms
+from models import SpeakerIndex
 from models import Wishlist
 from models import WishlistForm
 
+import confcache
+import counters
+import mailer
+import planner
+import schedule
+import seats
+import speakers
+import textsearch
+from serializers import Serializer
 from utils import getUserId
+from rpcstats import measured
 
 from settings import WEB_CLIENT_ID
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
-MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+MEMCACHE_NEARLY_SOLD_OUT_KEY = "NEARLY_SOLD_OUT"
+MEMCACHE_CAS_ATTEMPTS = 5
+NEARLY_SOLD_OUT_SEATS = 5
 MEMCACHE_SPEAKER_KEY = "FEATURED_SPEAKER_"
+WISHLIST_COUNTER = "WISHLIST_COUNT_%s"
+BACKFILL_BATCH_SIZE = 50
+ORGANIZER_NAME_BATCH_SIZE = 50
+MAX_BATCH_REGISTRATIONS = 20
+# one wishlist plus one counter shard per session must fit in an xg
+# transaction (25 entity groups)
+MAX_WISHLIST_BATCH = 20
+WISHLIST_ID = 'wishlist'    # key name of every new Wishlist under its Profile
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -66,7 +100,8 @@ OPERATORS = {
             'GTEQ': '>=',
             'LT':   '<',
             'LTEQ': '<=',
-            'NE':   '!='
+            'NE':   '!=',
+            'IN':   'IN',
             }
 
 FIELDS =    {
@@ -76,11 +111,84 @@ FIELDS =    {
             'MAX_ATTENDEES': 'maxAttendees',
             }
 
+SESSION_FIELDS = {
+            'TYPE': 'typeOfSession',
+            'SPEAKER': 'speaker',
+            'DATE': 'date',
+            'START_TIME': 'starttime',
+            }
+
+# what the query planner may push to the datastore; keep in line
+# with index.yaml
+CONFERENCE_QUERY = planner.Spec(Conference, {
+        'city': unicode,
+        'topics': unicode,
+        'month': int,
+        'maxAttendees': int,
+    }, order=['name'], composites=[
+        ([], None),
+        (['city'], None),
+        (['city', 'maxAttendees'], None),
+        (['city', 'maxAttendees', 'month'], None),
+        (['city', 'maxAttendees', 'month', 'topics'], None),
+        (['city', 'month'], None),
+        (['city', 'month', 'topics'], None),
+        (['city', 'topics'], None),
+        (['maxAttendees'], None),
+        (['maxAttendees', 'month'], None),
+        (['maxAttendees', 'month', 'topics'], None),
+        (['maxAttendees', 'topics'], None),
+        (['month'], None),
+        (['month', 'topics'], None),
+        (['topics'], None),
+        (['city', 'maxAttendees'], 'month'),
+        (['city'], 'maxAttendees'),
+        (['city'], 'month'),
+        (['maxAttendees'], 'month'),
+        ([], 'maxAttendees'),
+        ([], 'month'),
+    ])
+
+SESSION_QUERY = planner.Spec(Session, {
+        'typeOfSession': unicode,
+        'speaker': unicode,
+        'date': lambda value: datetime.strptime(value[:10], "%Y-%m-%d").date(),
+        'starttime': lambda value: datetime.strptime(value[:5], "%H:%M").time(),
+    }, composites=[
+        (['typeOfSession'], 'starttime'),
+        (['typeOfSession'], 'date'),
+        (['speaker'], 'starttime'),
+        (['speaker'], 'date'),
+    ])
+
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_LIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    fieldMask=messages.StringField(1),
+)
+
+SESS_LIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    fieldMask=messages.StringField(2),
+)
+
+SCHEDULE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    date=messages.StringField(2),
+    fromTime=messages.StringField(3),
+    toTime=messages.StringField(4),
+    fromDate=messages.StringField(5),
+    toDate=messages.StringField(6),
+    pageSize=messages.IntegerField(7),
+    cursor=messages.StringField(8),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
@@ -107,12 +215,62 @@ SESS_INFO_REQUEST = endpoints.ResourceContainer(
     wssk = messages.StringField(1),
 )
 
+SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    cursor=messages.StringField(3),
+)
+
+SPEAKER_PREFIX_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    prefix=messages.StringField(1),
+    limit=messages.IntegerField(2),
+)
+
 SPEAK_SESS_QUERY = endpoints.ResourceContainer (
     message_types.VoidMessage,
     speaker=messages.StringField(1),
     sessionType=messages.StringField(2),
 )
 
+FILTER_PLAYGROUND_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1),
+    cursor=messages.StringField(2),
+)
+
+# entity -> form copy plans, built once at import time
+CONFERENCE_SERIALIZER = Serializer(Conference, ConferenceForm, {
+    # convert Date to date string; just copy others
+    'startDate': lambda conf: str(conf.startDate),
+    'endDate': lambda conf: str(conf.endDate),
+    'websafeKey': lambda conf: conf.key.urlsafe(),
+})
+
+PROFILE_SERIALIZER = Serializer(Profile, ProfileForm, {
+    # convert t-shirt string to Enum; just copy others
+    'teeShirtSize': lambda prof: getattr(TeeShirtSize, prof.teeShirtSize),
+})
+
+SESSION_SERIALIZER = Serializer(Session, SessionForm, {
+    # convert Date & Time to strings; just copy others
+    'date': lambda sess: str(sess.date),
+    'starttime': lambda sess: str(sess.starttime),
+    'websafeKey': lambda sess: sess.key.urlsafe(),
+})
+
+WISHLIST_SERIALIZER = Serializer(Wishlist, WishlistForm)
+
+# list views asking only for these fields are served by projection
+# queries, which need the matching indexes in index.yaml; keys come
+# from the entity key
+CONFERENCE_LIST_PROJECTION = ('city', 'endDate', 'maxAttendees', 'month',
+    'name', 'organizerDisplayName', 'seatsAvailable', 'startDate')
+CONFERENCE_KEY_FIELDS = ('websafeKey',)
+SESSION_LIST_PROJECTION = ('date', 'duration', 'name', 'speaker',
+    'starttime', 'typeOfSession', 'wsck')
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
@@ -124,39 +282,45 @@ class ConferenceApi(remote.Service):
 
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
+    def _copyConferenceToForm(self, conf, displayName, fields=None):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
         if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
-        return cf
+            return CONFERENCE_SERIALIZER.one(conf, fields,
+                organizerDisplayName=displayName)
+        return CONFERENCE_SERIALIZER.one(conf, fields)
 
 
-    def _createConferenceObject(self, request):
-        """Create or update Conference object, returning ConferenceForm/request."""
-        # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+    def _fieldMask(self, fields, serializer):
+        """Parse a comma separated field mask; None means all fields."""
+        if not fields:
+            return None
+        mask = frozenset(name.strip() for name in fields.split(',') if name.strip())
+        unknown = mask - serializer.fieldNames()
+        if unknown:
+            raise endpoints.BadRequestException(
+                "Unknown field(s) in 'fieldMask': %s" % ', '.join(sorted(unknown)))
+        return mask
+
+
+    def _projection(self, mask, projection, derived=()):
+        """Return projection if the fields in mask can all be served
+        from it (or from the key), else None."""
+        if mask is not None and mask <= frozenset(projection).union(derived):
+            return projection
+        return None
 
+
+    @staticmethod
+    def _conferenceData(request):
+        """Check a new ConferenceForm and return the Conference property
+        values for it, filling in defaults on request too; shared by
+        createConference and the bulk importer."""
         if not request.name:
             raise endpoints.BadRequestException("Conference 'name' field required")
 
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
-        del data['organizerDisplayName']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -165,17 +329,29 @@ class ConferenceApi(remote.Service):
                 setattr(request, df, DEFAULTS[df])
 
         # convert dates from strings to Date objects; set month based on start_date
-        if data['startDate']:
-            data['startDate'] = datetime.strptime(data['startDate'][:10], "%Y-%m-%d").date()
-            data['month'] = data['startDate'].month
-        else:
-            data['month'] = 0
-        if data['endDate']:
-            data['endDate'] = datetime.strptime(data['endDate'][:10], "%Y-%m-%d").date()
+        try:
+            if data['startDate']:
+                data['startDate'] = datetime.strptime(data['startDate'][:10], "%Y-%m-%d").date()
+                data['month'] = data['startDate'].month
+            else:
+                data['month'] = 0
+            if data['endDate']:
+                data['endDate'] = datetime.strptime(data['endDate'][:10], "%Y-%m-%d").date()
+        except ValueError:
+            raise endpoints.BadRequestException("Dates must look like YYYY-MM-DD")
 
         # set seatsAvailable to be same as maxAttendees on creation
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
+        return data
+
+
+    def _createConferenceObject(self, request):
+        """Create or update Conference object, returning ConferenceForm/request."""
+        # preload necessary data items
+        user, user_id = self._currentUser()
+
+        data = self._conferenceData(request)
         # generate Profile Key based on user ID and Conference
         # ID based on Profile key get Conference key from ID
         p_key = ndb.Key(Profile, user_id)
@@ -183,24 +359,38 @@ class ConferenceApi(remote.Service):
         c_key = ndb.Key(Conference, c_id, parent=p_key)
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
-
-        # create Conference, send email to organizer confirming
-        # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
+        # keep the organizer's name on the Conference so listings need
+        # not fetch Profiles; _doProfile fans out later name changes
+        data['organizerDisplayName'] = request.organizerDisplayName = \
+            self._getProfileFromUser().displayName
+
+        # create Conference with its seat pools, send email to organizer
+        # confirming creation of Conference & return (modified) ConferenceForm
+        conf = Conference(**data)
+        pools = seats.createPools(conf, data["seatsAvailable"]) \
+            if data["seatsAvailable"] > 0 else []
+        seats.putWithPools(conf, pools)
+        confcache.queriesChanged()
+        textsearch.index([conf])
         # TODO 2: add confirmation email sending task to queue
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
+        # (batched into one digest per organizer by mailer.py)
+        mailer.notifyCreated(user.email(), conf)
         return request
 
 
-    @ndb.transactional()
     def _updateConferenceObject(self, request):
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        """Update Conference, then invalidate its cached ConferenceForm
+        and reindex it."""
+        cf = self._updateConferenceTxn(request)
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        confcache.conferenceChanged(c_key)
+        textsearch.indexKeys([c_key])
+        return cf
+
+
+    @ndb.transactional(xg=True)
+    def _updateConferenceTxn(self, request):
+        user, user_id = self._currentUser()
 
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
@@ -223,6 +413,19 @@ class ConferenceApi(remote.Service):
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data not in (None, []):
+                # free seats of a conference with pools live in the pools;
+                # a new maxAttendees moves seats in or out of them
+                if conf.seatShards and field.name == 'seatsAvailable':
+                    continue
+                # the organizer's name follows their Profile
+                if field.name == 'organizerDisplayName':
+                    continue
+                if conf.seatShards and field.name == 'maxAttendees':
+                    free = seats.resize(conf, data - (conf.maxAttendees or 0))
+                    if free is None:
+                        raise ConflictException(
+                            'More attendees are registered than %d.' % data)
+                    conf.seatsAvailable = free
                 # special handling for dates (convert string to Date)
                 if field.name in ('startDate', 'endDate'):
                     data = datetime.strptime(data, "%Y-%m-%d").date()
@@ -230,13 +433,17 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
+        if conf.organizerDisplayName is None:
+            # written before names were stored on Conferences
+            conf.organizerDisplayName = getattr(
+                ndb.Key(Profile, user_id).get(), 'displayName', None)
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return self._copyConferenceToForm(conf, None)
 
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
+    @measured
     def createConference(self, request):
         """Create new conference."""
         return self._createConferenceObject(request)
@@ -245,147 +452,296 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='PUT', name='updateConference')
+    @measured
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
         return self._updateConferenceObject(request)
 
 
+    @ndb.tasklet
+    def _legacyOrganizerNamesAsync(self, confs):
+        """Return {organizerUserId: displayName} for those conferences
+        written before organizerDisplayName was stored on them."""
+        # the organizer Profile is the Conference's parent
+        p_keys = list(set(conf.key.parent() for conf in confs
+            if conf.organizerDisplayName is None))
+        if not p_keys:
+            raise ndb.Return({})
+        profiles = yield ndb.get_multi_async(p_keys)
+        raise ndb.Return(dict((prof.key.id(), prof.displayName)
+            for prof in profiles if prof))
+
+
+    @ndb.tasklet
+    def _copyConferencesToFormsAsync(self, confs, fields=None):
+        """Return ConferenceForms for confs, with only the fields in
+        mask fields if given, looking up organizer names only for
+        conferences that lack them."""
+        if fields is None or 'organizerDisplayName' in fields:
+            names = yield self._legacyOrganizerNamesAsync(confs)
+        else:
+            names = {}
+        raise ndb.Return(ConferenceForms(
+            items=[self._copyConferenceToForm(conf,
+                names.get(conf.key.parent().id()), fields)
+            for conf in confs]
+        ))
+
+
+    @ndb.tasklet
+    def _getConferenceTasklet(self, wsck):
+        """Fetch Conference & its free seats; return ConferenceForm."""
+        conf = yield ndb.Key(urlsafe=wsck).get_async()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        # report the exact seat count from the pools, not the roll-up
+        conf.seatsAvailable, names = yield (seats.availableAsync(conf),
+            self._legacyOrganizerNamesAsync([conf]))
+        raise ndb.Return(self._copyConferenceToForm(conf, names.get(conf.key.parent().id())))
+
+
     @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='GET', name='getConference')
+    @measured
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
-        # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        wsck = request.websafeConferenceKey
+        cf, slot = confcache.get(ndb.Key(urlsafe=wsck))
+        if cf is None:
+            cf = self._getConferenceTasklet(wsck).get_result()
+            confcache.put(slot, cf)
+        return cf
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @ndb.tasklet
+    def _getConferencesCreatedTasklet(self, user_id, fields=None):
+        """Run ancestor query for user's conferences; return ConferenceForms
+        with only the fields in mask fields, if given."""
+        projection = self._projection(fields, CONFERENCE_LIST_PROJECTION,
+            CONFERENCE_KEY_FIELDS)
+        confs = yield Conference.query(ancestor=ndb.Key(Profile, user_id)).\
+            fetch_async(projection=projection)
+        # return set of ConferenceForm objects per Conference
+        forms = yield self._copyConferencesToFormsAsync(confs, fields)
+        raise ndb.Return(forms)
+
+
+    @endpoints.method(CONF_LIST_REQUEST, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
+    @measured
     def getConferencesCreated(self, request):
-        """Return conferences created by user."""
+        """Return conferences created by user; fieldMask optionally
+        lists the ConferenceForm fields to return."""
         # make sure user is authed
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id =  getUserId(user)
-        # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
-        # return set of ConferenceForm objects per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
-        )
+        user, user_id = self._currentUser()
+        fields = self._fieldMask(request.fieldMask, CONFERENCE_SERIALIZER)
+        return self._getConferencesCreatedTasklet(user_id, fields).get_result()
 
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
+    def _getQuery(self, predicates, pushed=None):
+        """Return the query plan for the submitted filters; pushed, from
+        the request's cursor, rebuilds the plan of the previous page."""
+        return self._plan(CONFERENCE_QUERY, predicates, pushed)
 
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
 
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-        return q
+    def _plan(self, spec, predicates, pushed=None, ancestor=None):
+        """Return the planner's plan for predicates, or the one pushed
+        names; a pushed set that doesn't fit the predicates means the
+        cursor came from another query."""
+        try:
+            return planner.plan(spec, predicates,
+                planner.getStats(spec.model), ancestor, pushed)
+        except ValueError:
+            raise endpoints.BadRequestException("Invalid 'cursor' value.")
 
 
-    def _formatFilters(self, filters):
-        """Parse, check validity and format user supplied filters."""
-        formatted_filters = []
-        inequality_field = None
+    def _formatFilters(self, filters, fields, spec):
+        """Parse, check validity and format user supplied filters into
+        planner Predicates, in canonical order (cursors, and cached
+        pages holding them, refer to predicates by position)."""
+        predicates = []
 
         for f in filters:
-            filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
-
             try:
-                filtr["field"] = FIELDS[filtr["field"]]
-                filtr["operator"] = OPERATORS[filtr["operator"]]
+                field = fields[f.field]
+                operator = OPERATORS[f.operator]
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
+            # the planner runs whatever the datastore can't, e.g. more
+            # than one inequality field, in memory
+            convert = spec.convert[field]
+            if f.value is None:
+                raise endpoints.BadRequestException(
+                    "Filter on %s needs a value." % f.field)
+            try:
+                if operator == 'IN':
+                    value = [convert(v.strip()) for v in f.value.split(',')]
                 else:
-                    inequality_field = filtr["field"]
+                    value = convert(f.value)
+            except (TypeError, ValueError):
+                raise endpoints.BadRequestException(
+                    "Invalid value for filter on %s: %s" % (f.field, f.value))
+            predicates.append(planner.Predicate(field, operator, value))
+        return planner.canonical(predicates)
 
-            formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+
+    def _runPlan(self, plan, pageSize, cursor, projection=None):
+        """Return (entities, next cursor token or None) of one page of
+        plan; the token carries the plan on to the next page."""
+        try:
+            entities, next_cursor, more = planner.run(plan, pageSize, cursor,
+                projection=projection)
+        except datastore_errors.BadRequestError:
+            # cursor does not belong to this query (e.g. filters changed)
+            raise endpoints.BadRequestException("Invalid 'cursor' value.")
+        except planner.TooManyScanned:
+            raise endpoints.BadRequestException(
+                'Query too broad; add a more selective filter.')
+        if not (more and next_cursor):
+            return entities, None
+        return entities, planner.encodeCursor(plan, next_cursor)
+
+
+    def _pageSize(self, request):
+        """Return the page size of a paged request."""
+        pageSize = request.pageSize or DEFAULT_PAGE_SIZE
+        if pageSize < 1 or pageSize > MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                "'pageSize' must be between 1 and %d." % MAX_PAGE_SIZE)
+        return pageSize
+
+
+    def _pageOptions(self, request):
+        """Return (page size, start cursor) from a paged query request."""
+        pageSize = self._pageSize(request)
+        if not request.cursor:
+            return pageSize, None
+        try:
+            return pageSize, ndb.Cursor(urlsafe=request.cursor)
+        except datastore_errors.BadValueError:
+            raise endpoints.BadRequestException("Invalid 'cursor' value.")
+
+
+    def _plannedPageOptions(self, request):
+        """Return (page size, pushed predicate indices, start cursor)
+        from a planner-paged request; both are None on the first page."""
+        pageSize = self._pageSize(request)
+        if not request.cursor:
+            return pageSize, None, None
+        try:
+            pushed, cursor = planner.decodeCursor(request.cursor)
+        except ValueError:
+            raise endpoints.BadRequestException("Invalid 'cursor' value.")
+        return pageSize, pushed, cursor
 
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
             path='queryConferences',
             http_method='POST',
             name='queryConferences')
+    @measured
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
-
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
-
-        # return individual ConferenceForm object per Conference
-        return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
-                conferences]
-        )
+        """Query for conferences, one page at a time; fieldMask
+        optionally lists the ConferenceForm fields to return."""
+        pageSize, pushed, cursor = self._plannedPageOptions(request)
+        fields = self._fieldMask(request.fieldMask, CONFERENCE_SERIALIZER)
+        predicates = self._formatFilters(request.filters, FIELDS, CONFERENCE_QUERY)
+        forms, slot = confcache.getQuery(predicates, pageSize, request.cursor,
+            fields)
+        if forms is not None:
+            return forms
+        plan = self._getQuery(predicates, pushed)
+        # only the unfiltered listing has an index for the projection
+        projection = None
+        if not plan.pushed and not plan.residual:
+            projection = self._projection(fields, CONFERENCE_LIST_PROJECTION,
+                CONFERENCE_KEY_FIELDS)
+        conferences, next_cursor = self._runPlan(
+            plan, pageSize, cursor, projection)
+
+        # return individual ConferenceForm object per Conference, plus
+        # the cursor to continue from when there are more results
+        forms = self._copyConferencesToFormsAsync(conferences, fields).get_result()
+        forms.nextCursor = next_cursor
+        confcache.putQuery(slot, forms)
+        return forms
+
+
+    def _searchPage(self, index_name, request):
+        """Return (entities, next cursor) of one page of a keyword
+        search, best match first."""
+        if not request.query:
+            raise endpoints.BadRequestException("'query' field required")
+        try:
+            keys, next_cursor = textsearch.query(index_name, request.query,
+                self._pageSize(request), request.cursor)
+        except search.QueryError:
+            raise endpoints.BadRequestException("Invalid 'query' value.")
+        except (ValueError, search.InvalidRequest):
+            raise endpoints.BadRequestException("Invalid 'cursor' value.")
+        # the index may briefly list entities deleted since
+        entities = [entity for entity in ndb.get_multi(keys) if entity]
+        return entities, next_cursor
+
+
+    @endpoints.method(SEARCH_REQUEST, ConferenceForms,
+            path='searchConferences',
+            http_method='GET', name='searchConferences')
+    @measured
+    def searchConferences(self, request):
+        """Keyword search over conference name, description, topics
+        and city, one page at a time."""
+        conferences, next_cursor = self._searchPage(
+            textsearch.CONFERENCE_INDEX, request)
+        forms = self._copyConferencesToFormsAsync(conferences).get_result()
+        forms.nextCursor = next_cursor
+        return forms
 
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
+        return PROFILE_SERIALIZER.one(prof)
 
 
-    def _getProfileFromUser(self):
-        """Return user Profile from datastore, creating new one if non-existent."""
+    def _currentUser(self):
+        """Return (user, user id) of the signed-in user, resolved once
+        per request (the service object lives for one request)."""
         # make sure user is authed
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
+        memo = getattr(self, '_userMemo', None)
+        if memo is None or memo[0] != user:
+            memo = self._userMemo = (user, getUserId(user))
+            self._profileMemo = None
+        return memo
+
+
+    def _getProfileFromUser(self):
+        """Return user Profile from datastore, creating new one if non-existent.
+
+        Outside a transaction the Profile is read once per request;
+        inside one it is always read afresh, and the request's copy is
+        dropped since the transaction may change it.
+        """
+        user, user_id = self._currentUser()
+        inTxn = ndb.in_transaction()
+        if inTxn:
+            self._profileMemo = None
+        elif self._profileMemo is not None:
+            return self._profileMemo
 
         # get Profile from datastore
-        user_id = getUserId(user)
         p_key = ndb.Key(Profile, user_id)
         profile = p_key.get()
-        # create new Profile if not there
+        # create new Profile if not there; its Wishlist is created on
+        # first use by _getUserWishlist
         if not profile:
             profile = Profile(
                 key = p_key,
@@ -393,18 +749,10 @@ class ConferenceApi(remote.Service):
                 mainEmail= user.email(),
                 teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
             )
-
-            w_id = Wishlist.allocate_ids(size=1, parent=p_key)[0]
-            w_key = ndb.Key(Wishlist, w_id, parent=p_key)
-
-            wishlist = Wishlist(
-                key = w_key,
-                sessionKeys = []
-            )
-
             profile.put()
-            wishlist.put()
 
+        if not inTxn:
+            self._profileMemo = profile
         return profile      # return Profile
 
 
@@ -415,23 +763,48 @@ class ConferenceApi(remote.Service):
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
+            changes = {}
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
                     if val:
-                        setattr(prof, field, str(val))
+                        changes[field] = str(val)
                         #if field == 'teeShirtSize':
-                        #    setattr(prof, field, str(val).upper())
+                        #    changes[field] = str(val).upper()
                         #else:
-                        #    setattr(prof, field, val)
-            prof.put()
+                        #    changes[field] = val
+            prof, renamed = self._saveProfileTxn(prof.key, changes)
+            self._profileMemo = prof
+            if renamed:
+                # organizer displayName is part of cached ConferenceForms
+                confcache.organizerChanged(prof.key.id())
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
 
 
+    @ndb.transactional()
+    def _saveProfileTxn(self, p_key, changes):
+        """Apply changes to the Profile; if its displayName changed,
+        queue the copy onto the user's conferences in the same
+        transaction, so a saved name is never left unpropagated. Return
+        (Profile, whether it was renamed)."""
+        prof = p_key.get()
+        oldName = prof.displayName
+        for field, val in changes.items():
+            setattr(prof, field, val)
+        prof.put()
+        renamed = prof.displayName != oldName
+        if renamed:
+            taskqueue.add(params={'user_id': p_key.id()},
+                url='/tasks/update_organizer_name', transactional=True
+            )
+        return prof, renamed
+
+
     @endpoints.method(message_types.VoidMessage, ProfileForm,
             path='profile', http_method='GET', name='getProfile')
+    @measured
     def getProfile(self, request):
         """Return user profile."""
         return self._doProfile()
@@ -439,24 +812,50 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(ProfileMiniForm, ProfileForm,
             path='profile', http_method='POST', name='saveProfile')
+    @measured
     def saveProfile(self, request):
         """Update & return user profile."""
         return self._doProfile(request)
 
 
+    @staticmethod
+    def _updateOrganizerName(user_id, cursor=None):
+        """Copy the organizer's current displayName onto one batch of
+        their Conferences; used by the fan-out task. Return the cursor
+        of the next batch or None.
+        """
+        p_key = ndb.Key(Profile, user_id)
+        c_keys, next_cursor, more = Conference.query(ancestor=p_key).fetch_page(
+            ORGANIZER_NAME_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+
+        # Conferences share their organizer's entity group, so one
+        # transaction covers the batch without clobbering concurrent
+        # updates or seat changes
+        @ndb.transactional()
+        def _rename():
+            name = p_key.get().displayName
+            confs = [conf for conf in ndb.get_multi(c_keys)
+                if conf and conf.organizerDisplayName != name]
+            for conf in confs:
+                conf.organizerDisplayName = name
+            ndb.put_multi(confs)
+        _rename()
+        confcache.organizerChanged(user_id)
+        return next_cursor if more else None
+
+
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
     @ndb.transactional(xg=True)
-    def _conferenceRegistration(self, request, reg=True):
-        """Register or unregister user for selected conference."""
+    def _registrationTxn(self, wsck, pool_key, reg):
+        """Update user Profile & take/give back a seat in one pool: a
+        SeatShard, or the Conference itself if it has no pools. A None
+        pool_key means every pool of the conference is empty. Return
+        (BooleanMessage, pool after the change)."""
         retval = None
         prof = self._getProfileFromUser() # get user Profile
-
-        # check if conf exists given websafeConfKey
-        # get conference; check that it exists
-        wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
-        if not conf:
+        pool = pool_key.get() if pool_key else None
+        if pool_key and pool_key.kind() == 'Conference' and not pool:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
 
@@ -468,13 +867,17 @@ class ConferenceApi(remote.Service):
                     "You have already registered for this conference")
 
             # check if seats avail
-            if conf.seatsAvailable <= 0:
+            if not pool_key or pool_key.kind() == 'Conference' and \
+                    pool.seatsAvailable <= 0:
                 raise ConflictException(
                     "There are no seats available.")
+            if not pool or pool.seatsAvailable <= 0:
+                # other registrants emptied this pool; try another one
+                raise seats.PoolExhausted()
 
             # register user, take away one seat
             prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
+            pool.seatsAvailable -= 1
             retval = True
 
         # unregister
@@ -484,44 +887,228 @@ class ConferenceApi(remote.Service):
 
                 # unregister user, add back one seat
                 prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
+                pool = pool or SeatShard(key=pool_key)
+                pool.seatsAvailable += 1
                 retval = True
             else:
-                retval = False
+                return BooleanMessage(data=False), pool
 
         # write things back to the datastore & return
-        prof.put()
-        conf.put()
-        return BooleanMessage(data=retval)
+        ndb.put_multi([prof, pool])
+        return BooleanMessage(data=retval), pool
+
+
+    def _conferenceRegistration(self, request, reg=True):
+        """Register or unregister user for selected conference."""
+        # check if conf exists given websafeConfKey
+        # get conference; check that it exists
+        wsck = request.websafeConferenceKey
+        conf = ndb.Key(urlsafe=wsck).get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+
+        # conferences without seat pools keep the seat count on the
+        # Conference entity itself
+        change = -1 if reg else 1
+        if not conf.seatShards:
+            retval, pool = self._registrationTxn(wsck, conf.key, reg)
+            if retval.data:
+                confcache.conferenceChanged(conf.key)
+                self._trackNearlySoldOut(conf,
+                    pool.seatsAvailable - change, pool.seatsAvailable)
+            return retval
+
+        # take or give back a seat in one pool; if another registrant
+        # emptied it first, pick again from a fresh read of the pools
+        def picks():
+            for attempt in range(seats.MAX_RESERVE_ATTEMPTS):
+                yield seats.pickShard(conf, reg)
+            # still losing the race: try each pool with seats in turn,
+            # so sold out means every pool was empty when we got to it
+            pool_keys, free = seats.nonEmptyPools(conf)
+            for pool_key in pool_keys:
+                yield pool_key, free
+
+        for pool_key, free in picks():
+            try:
+                retval, pool = self._registrationTxn(wsck, pool_key, reg)
+            except seats.PoolExhausted:
+                continue
+            if retval.data:
+                confcache.conferenceChanged(conf.key)
+                seats.scheduleSync(conf)
+                # free is a snapshot from just before our change; the
+                # cron rebuild corrects any drift from concurrent changes
+                self._trackNearlySoldOut(conf, free, free + change)
+            return retval
+        raise ConflictException(
+            "There are no seats available.")
+
+
+    @ndb.transactional()
+    def _updateAttendanceTxn(self, p_key, wscks, reg):
+        """Add (reg) or remove conference keys to/from the Profile's
+        conferenceKeysToAttend; return the keys actually changed."""
+        prof = p_key.get()
+        attending = prof.conferenceKeysToAttend
+        if reg:
+            changed = [wsck for wsck in wscks if wsck not in attending]
+            attending.extend(changed)
+        else:
+            changed = [wsck for wsck in wscks if wsck in attending]
+            for wsck in changed:
+                attending.remove(wsck)
+        if changed:
+            prof.put()
+            # the request's copy of the Profile is now stale
+            self._profileMemo = None
+        return changed
+
+
+    def _seatsChanged(self, confs):
+        """Invalidate the cached forms of confs, whose seat counts
+        changed, and schedule the roll-up of their pools."""
+        for conf in confs:
+            confcache.conferenceChanged(conf.key)
+            if conf.seatShards:
+                seats.scheduleSync(conf)
+
+
+    def _conferenceRegistrations(self, request, reg=True):
+        """Register or unregister user for several conferences at once.
+
+        The Profile is read and written once; the seat changes run in
+        parallel, each in its own transaction. Seats are taken before
+        the Profile is updated and given back after it, so a failure in
+        between can only leave a seat unused, never oversold.
+        """
+        wscks = []
+        for wsck in request.websafeConferenceKeys:
+            if wsck not in wscks:
+                wscks.append(wsck)
+        if len(wscks) > MAX_BATCH_REGISTRATIONS:
+            raise endpoints.BadRequestException(
+                'At most %d conferences per request.' % MAX_BATCH_REGISTRATIONS)
+
+        prof = self._getProfileFromUser() # get user Profile
+        results = [RegistrationResultForm(websafeConferenceKey=key, success=False)
+            for key in wscks]
+        notFound = 'No conference found with key: %s'
+        c_keys = []
+        for result in results:
+            try:
+                c_keys.append(ndb.Key(urlsafe=result.websafeConferenceKey))
+            except Exception:
+                c_keys.append(None)
+        confs = ndb.get_multi([c_key for c_key in c_keys if c_key])
+        confs = dict((conf.key.urlsafe(), conf) for conf in confs if conf)
+
+        todo = []
+        for result in results:
+            wsck = result.websafeConferenceKey
+            conf = confs.get(wsck)
+            if not conf:
+                result.error = notFound % wsck
+            elif reg and wsck in prof.conferenceKeysToAttend:
+                result.error = "You have already registered for this conference"
+            elif reg or wsck in prof.conferenceKeysToAttend:
+                todo.append((result, conf))
+
+        if reg:
+            # take the seats first ...
+            futures = [seats.changeAsync(item[1], reg) for item in todo]
+            taken = []
+            for (result, conf), future in zip(todo, futures):
+                done, before = future.get_result()
+                if done:
+                    taken.append((result, conf, before))
+                else:
+                    result.error = "There are no seats available."
+            # ... then record them on the Profile, giving back any seat the
+            # Profile did not take (e.g. registered concurrently)
+            try:
+                changed = self._updateAttendanceTxn(prof.key,
+                    [item[0].websafeConferenceKey for item in taken], reg)
+            except Exception:
+                ndb.Future.wait_all([seats.changeAsync(item[1], False)
+                    for item in taken])
+                self._seatsChanged([item[1] for item in taken])
+                raise
+            giveBack = [item[1] for item in taken
+                if item[0].websafeConferenceKey not in changed]
+            ndb.Future.wait_all([seats.changeAsync(given, False)
+                for given in giveBack])
+            for result, conf, before in taken:
+                if result.websafeConferenceKey not in changed:
+                    result.error = "You have already registered for this conference"
+        else:
+            # drop the conferences from the Profile first, then give the
+            # seats back
+            changed = self._updateAttendanceTxn(prof.key,
+                [item[0].websafeConferenceKey for item in todo], reg)
+            todo = [item for item in todo
+                if item[0].websafeConferenceKey in changed]
+            futures = [seats.changeAsync(item[1], reg) for item in todo]
+            taken = [item + (future.get_result()[1],)
+                for item, future in zip(todo, futures)]
+
+        # every pool touched, including seats taken and given back,
+        # may have been read into a cached form in between
+        self._seatsChanged([item[1] for item in taken])
+        change = -1 if reg else 1
+        for result, conf, before in taken:
+            if result.websafeConferenceKey not in changed:
+                continue
+            result.success = True
+            self._trackNearlySoldOut(conf, before, before + change)
+        return RegistrationResultForms(items=results)
+
+
+    @endpoints.method(ConferenceKeysForm, RegistrationResultForms,
+            path='conferences/register',
+            http_method='POST', name='registerForConferences')
+    @measured
+    def registerForConferences(self, request):
+        """Register user for several conferences; result per conference."""
+        return self._conferenceRegistrations(request)
+
+
+    @endpoints.method(ConferenceKeysForm, RegistrationResultForms,
+            path='conferences/unregister',
+            http_method='POST', name='unregisterFromConferences')
+    @measured
+    def unregisterFromConferences(self, request):
+        """Unregister user from several conferences; result per conference."""
+        return self._conferenceRegistrations(request, reg=False)
+
+
+    @ndb.tasklet
+    def _getConferencesToAttendTasklet(self, prof):
+        """Fetch attended Conferences in one batch; return ConferenceForms."""
+        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
+        conferences = yield ndb.get_multi_async(conf_keys)
+
+        # return set of ConferenceForm objects per Conference
+        forms = yield self._copyConferencesToFormsAsync(
+            [conf for conf in conferences if conf])
+        raise ndb.Return(forms)
 
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
+    @measured
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser() # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
-
-        # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
-         for conf in conferences]
-        )
+        return self._getConferencesToAttendTasklet(prof).get_result()
 
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='POST', name='registerForConference')
+    @measured
     def registerForConference(self, request):
         """Register user for selected conference."""
         return self._conferenceRegistration(request)
@@ -530,6 +1117,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='DELETE', name='unregisterFromConference')
+    @measured
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
         return self._conferenceRegistration(request, reg=False)
@@ -537,71 +1125,95 @@ class ConferenceApi(remote.Service):
 
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
+    @staticmethod
+    def _formatAnnouncement(confs):
+        """Return the announcement text for a {wsck: name} dict of
+        nearly sold out conferences."""
+        if not confs:
+            return ""
+        return '%s %s' % (
+            'Last chance to attend! The following conferences '
+            'are nearly sold out:',
+            ', '.join(sorted(confs.values())))
+
+
     @staticmethod
     def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+        """Rebuild the nearly sold out set in memcache from the datastore
+        & return the Announcement; used by memcache cron job & on a
+        getAnnouncement() cache miss.
         """
         confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
+            Conference.seatsAvailable <= NEARLY_SOLD_OUT_SEATS,
             Conference.seatsAvailable > 0)
         ).fetch(projection=[Conference.name])
 
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = '%s %s' % (
-                'Last chance to attend! The following conferences '
-                'are nearly sold out:',
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+        # an empty set is cached too, so a miss always means "rebuild"
+        nearlySoldOut = dict((conf.key.urlsafe(), conf.name) for conf in confs)
+        memcache.set(MEMCACHE_NEARLY_SOLD_OUT_KEY, nearlySoldOut)
+        return ConferenceApi._formatAnnouncement(nearlySoldOut)
+
 
-        return announcement
+    @staticmethod
+    def _trackNearlySoldOut(conf, seatsBefore, seatsAfter):
+        """Add conf to or drop it from the cached nearly sold out set
+        when its free seats cross the threshold."""
+        nearly = 0 < seatsAfter <= NEARLY_SOLD_OUT_SEATS
+        if nearly == (0 < seatsBefore <= NEARLY_SOLD_OUT_SEATS):
+            return
+        wsck = conf.key.urlsafe()
+        client = memcache.Client()
+        for attempt in range(MEMCACHE_CAS_ATTEMPTS):
+            confs = client.gets(MEMCACHE_NEARLY_SOLD_OUT_KEY)
+            if confs is None:
+                # evicted or never built; next read rebuilds it
+                return
+            if nearly:
+                confs[wsck] = conf.name
+            else:
+                confs.pop(wsck, None)
+            if client.cas(MEMCACHE_NEARLY_SOLD_OUT_KEY, confs):
+                return
+        # too much contention; drop the set so the next read rebuilds it
+        memcache.delete(MEMCACHE_NEARLY_SOLD_OUT_KEY)
 
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
+    @measured
     def getAnnouncement(self, request):
-        """Return Announcement from memcache."""
-        # TODO 1
-        # return an existing announcement from Memcache or an empty string.
-        announcement = ""
-        return StringMessage(data=announcement)
+        """Return Announcement from memcache, rebuilding it on a miss."""
+        confs = memcache.get(MEMCACHE_NEARLY_SOLD_OUT_KEY)
+        if confs is None:
+            return StringMessage(data=self._cacheAnnouncement())
+        return StringMessage(data=self._formatAnnouncement(confs))
 
-    @endpoints.method(CONF_GET_REQUEST,SessionForms,
+    @endpoints.method(SESS_LIST_REQUEST,SessionForms,
             path='conferences/{websafeConferenceKey}',
             http_method='GET',name='getConferenceSessions')
+    @measured
     def getConferenceSessions(self, request):
-        """Return sessions for a particular conference."""
+        """Return sessions for a particular conference; fieldMask
+        optionally lists the SessionForm fields to return."""
         wsck = request.websafeConferenceKey
+        fields = self._fieldMask(request.fieldMask, SESSION_SERIALIZER)
+        projection = self._projection(fields, SESSION_LIST_PROJECTION,
+            ('websafeKey',))
         # create ancestor query for all key matches for this user
-        sessions = Session.query(ancestor=ndb.Key(urlsafe=wsck))
+        sessions = Session.query(ancestor=ndb.Key(urlsafe=wsck)).\
+            fetch(projection=projection)
         return SessionForms(
-                items=[self._copySessionToForm(sess) for sess in \
-                sessions]
+                items=SESSION_SERIALIZER.many(sessions, fields)
         )
 
     def _copySessionToForm(self, sess):
         """Copy relevant fields from Session to SessionForm."""
-        se = SessionForm()
-        for field in se.all_fields():
-            if hasattr(sess, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('date') or field.name.endswith('starttime'):
-                    setattr(se, field.name, str(getattr(sess, field.name)))
-                else:
-                    setattr(se, field.name, getattr(sess, field.name))
-        se.check_initialized()
-        return se
+        return SESSION_SERIALIZER.one(sess)
 
     @endpoints.method(SessionForm, SessionForm, path='session',
             http_method='POST', name='createSession')
+    @measured
     def createSession(self, request):
         """Create new conference session."""
         return self._createSessionObject(request)
@@ -609,14 +1221,9 @@ class ConferenceApi(remote.Service):
     def _createSessionObject(self, request):
         """Create or update Conference Session object, returning SessionForm/request."""
         # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        user, user_id = self._currentUser()
 
-        # Camacho - make sure a name was entered for the session
-        if not request.name:
-            raise endpoints.BadRequestException("Session 'name' field required")
+        data = self._sessionData(request)
 
         # Get the conference object from the wsck input
         try:
@@ -630,17 +1237,6 @@ class ConferenceApi(remote.Service):
         if user_id != conf.organizerUserId:
             raise endpoints.UnauthorizedException('You are not the creator of this conference')
 
-        # copy SessionForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
-
-        # convert dates from strings to Date objects; set month based on start_date
-        if data['date']:
-            data['date'] = datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
-
-        # Camacho - convert string times into time objects
-        if data['starttime']:
-            data['starttime'] = datetime.strptime(data['starttime'][:5], "%H:%M").time()
-
         # Camacho - get the conference key, create the session
         # key by inputting the conference key as its parent
         c_key = conf.key
@@ -648,21 +1244,218 @@ class ConferenceApi(remote.Service):
         s_key = ndb.Key(Session, s_id, parent=c_key)
         data['key'] = s_key
 
-        Session(**data).put()
-        # Camacho - after adding the session, add a task to the queue to
-        # check if the session's speaker should be a featured speaker
-        if data['speaker']:
-            taskqueue.add(params={
-                'speaker': data['speaker'],
-                'wsck':data['wsck']},
-                url='/tasks/check_session_speaker'
-            )
+        # write the session & update the conference's speaker index and
+        # the speaker directory in one transaction, so the featured
+        # speaker is known right away
+        sess = Session(**data)
+        featured = self._putSessionIndexSpeaker(sess)
+        if featured:
+            memcache.set(MEMCACHE_SPEAKER_KEY + c_key.urlsafe(), featured)
+        textsearch.index([sess])
+        request.websafeKey = s_key.urlsafe()
         return request
 
 
+    @staticmethod
+    def _sessionData(request):
+        """Check a new SessionForm and return the Session property values
+        for it; shared by createSession and the bulk importer."""
+        # Camacho - make sure a name was entered for the session
+        if not request.name:
+            raise endpoints.BadRequestException("Session 'name' field required")
+
+        # copy SessionForm/ProtoRPC Message into dict
+        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
+        del data['websafeKey']
+
+        # convert dates from strings to Date objects; set month based on start_date
+        try:
+            if data['date']:
+                data['date'] = datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
+
+            # Camacho - convert string times into time objects
+            if data['starttime']:
+                data['starttime'] = datetime.strptime(data['starttime'][:5], "%H:%M").time()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Dates must look like YYYY-MM-DD and times like HH:MM")
+        return data
+
+
+    @ndb.transactional(xg=True)
+    def _putSessionIndexSpeaker(self, sess):
+        """Write Session, count it for its speaker in the Conference's
+        SpeakerIndex & list it in the speaker directory. Return the new
+        featured speaker text, if changed."""
+        sess.put()
+        if not speakers.normalize(sess.speaker):
+            return None
+        speakers.addSessions(sess.speaker, [sess.key])
+        idx_key = ndb.Key(SpeakerIndex, 1, parent=sess.key.parent())
+        # conferences from before the index get theirs from their
+        # sessions so far; the query doesn't see sess, put in this
+        # transaction
+        idx = idx_key.get() or self._speakerIndexFromSessions(idx_key.parent())
+        names = idx.sessions.setdefault(speakers.normalize(sess.speaker), [])
+        names.append(sess.name)
+        # Camacho - a speaker with more than one session at the
+        # conference becomes its featured speaker
+        featured = None
+        if len(names) > 1:
+            featured = idx.featured = 'Speaker: ' + sess.speaker + \
+                '. Sessions: ' + ', '.join(names)
+        idx.put()
+        return featured
+
+
+    @endpoints.method(SEARCH_REQUEST, SessionForms,
+            path='searchSessions',
+            http_method='GET', name='searchSessions')
+    @measured
+    def searchSessions(self, request):
+        """Keyword search over session name, highlights, speaker and
+        type across all conferences, one page at a time."""
+        sessions, next_cursor = self._searchPage(
+            textsearch.SESSION_INDEX, request)
+        return SessionForms(
+                items=SESSION_SERIALIZER.many(sessions),
+                nextCursor=next_cursor
+        )
+
+    @endpoints.method(SessionQueryForms, SessionForms,
+            path='querySessions',
+            http_method='POST', name='querySessions')
+    @measured
+    def querySessions(self, request):
+        """Query for sessions, of one conference if a
+        websafeConferenceKey is given, one page at a time."""
+        pageSize, pushed, cursor = self._plannedPageOptions(request)
+        ancestor = None
+        if request.websafeConferenceKey:
+            try:
+                ancestor = ndb.Key(urlsafe=request.websafeConferenceKey)
+            except Exception:
+                raise endpoints.BadRequestException(
+                    "Invalid 'websafeConferenceKey' value")
+        plan = self._plan(SESSION_QUERY,
+            self._formatFilters(request.filters, SESSION_FIELDS, SESSION_QUERY),
+            pushed, ancestor)
+        sessions, next_cursor = self._runPlan(plan, pageSize, cursor)
+        return SessionForms(
+                items=SESSION_SERIALIZER.many(sessions),
+                nextCursor=next_cursor
+        )
+
+    @staticmethod
+    @ndb.transactional()
+    def _rebuildSpeakerIndex(c_key):
+        """Recompute a Conference's SpeakerIndex from its sessions, e.g.
+        after a bulk import; the featured speaker becomes the one with
+        the most sessions there, if any has more than one."""
+        idx = ConferenceApi._speakerIndexFromSessions(c_key)
+        idx.put()
+        return idx.featured
+
+    @staticmethod
+    def _speakerIndexFromSessions(c_key):
+        """Return a new, unsaved SpeakerIndex of the Conference's
+        sessions, for _rebuildSpeakerIndex."""
+        idx = SpeakerIndex(key=ndb.Key(SpeakerIndex, 1, parent=c_key),
+            sessions={})
+        displayNames = {}
+        for sess in Session.query(ancestor=c_key):
+            norm = speakers.normalize(sess.speaker)
+            if norm:
+                idx.sessions.setdefault(norm, []).append(sess.name)
+                displayNames.setdefault(norm, sess.speaker)
+        busiest = sorted(idx.sessions.items(), key=lambda item: (-len(item[1]), item[0]))
+        if busiest and len(busiest[0][1]) > 1:
+            norm, names = busiest[0]
+            idx.featured = 'Speaker: ' + displayNames[norm] + \
+                '. Sessions: ' + ', '.join(names)
+        return idx
+
+    @endpoints.method(SCHEDULE_REQUEST, SessionForms,
+            path='conferences/{websafeConferenceKey}/schedule',
+            http_method='GET', name='getConferenceSchedule')
+    @measured
+    def getConferenceSchedule(self, request):
+        """Return a conference's sessions in date & start time order, one
+        page at a time. Either give a date, optionally with a fromTime
+        and/or toTime, or a fromDate and/or toDate range."""
+        pageSize, cursor = self._pageOptions(request)
+        try:
+            c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        except Exception:
+            raise endpoints.BadRequestException(
+                "Invalid 'websafeConferenceKey' value")
+        q = self._scheduleQuery(c_key, request)
+        try:
+            sessions, next_cursor, more = q.fetch_page(pageSize,
+                start_cursor=cursor)
+        except datastore_errors.BadRequestError:
+            raise endpoints.BadRequestException("Invalid 'cursor' value.")
+        return SessionForms(
+                items=SESSION_SERIALIZER.many(sessions),
+                nextCursor=next_cursor.urlsafe() if more and next_cursor else None
+        )
+
+    def _scheduleQuery(self, c_key, request):
+        """Return the range query for a schedule request; all its shapes
+        are served by the (ancestor, date, starttime) index."""
+        asDate = SESSION_QUERY.convert['date']
+        asTime = SESSION_QUERY.convert['starttime']
+        def parse(name, convert):
+            value = getattr(request, name)
+            try:
+                return convert(value) if value else None
+            except ValueError:
+                raise endpoints.BadRequestException(
+                    "Invalid '%s' value: %s" % (name, value))
+        q = Session.query(ancestor=c_key)
+        if request.date:
+            if request.fromDate or request.toDate:
+                raise endpoints.BadRequestException(
+                    "Give either 'date' or 'fromDate'/'toDate'.")
+            # one day: equality on date leaves the range for starttime
+            q = q.filter(Session.date == parse('date', asDate))
+            fromTime, untilTime = parse('fromTime', asTime), parse('toTime', asTime)
+            if fromTime:
+                q = q.filter(Session.starttime >= fromTime)
+            if untilTime:
+                q = q.filter(Session.starttime < untilTime)
+            return q.order(Session.starttime)
+        if request.fromTime or request.toTime:
+            raise endpoints.BadRequestException(
+                "'fromTime'/'toTime' need a 'date'.")
+        fromDate, untilDate = parse('fromDate', asDate), parse('toDate', asDate)
+        if fromDate:
+            q = q.filter(Session.date >= fromDate)
+        if untilDate:
+            q = q.filter(Session.date <= untilDate)
+        return q.order(Session.date, Session.starttime)
+
+    @endpoints.method(message_types.VoidMessage, SessionConflictForms,
+            path='getWishlistConflicts',
+            http_method='GET', name='getWishlistConflicts')
+    @measured
+    def getWishlistConflicts(self, request):
+        """Return the pairs of sessions in the user's wishlist whose
+        times overlap. Sessions without a date, start time or readable
+        duration are left out."""
+        wl = self._getUserWishlist()
+        sessions = ndb.get_multi([ndb.Key(urlsafe=k) for k in wl.sessionKeys])
+        pairs = schedule.conflicts([sess for sess in sessions if sess])
+        return SessionConflictForms(items=[SessionConflictForm(
+                first=self._copySessionToForm(first),
+                second=self._copySessionToForm(second),
+            ) for first, second in pairs]
+        )
+
     @endpoints.method(SESS_TYPE_REQUEST,SessionForms,
             path='getConferenceSessionsByType',
             http_method='GET',name='getConferenceSessionsByType')
+    @measured
     def getConferenceSessionsByType(self, request):
         """Return sessions for a particular conference of a particular type."""
         wsck = request.websafeConferenceKey
@@ -671,172 +1464,221 @@ class ConferenceApi(remote.Service):
         sessions = Session.query(ancestor=ndb.Key(urlsafe=wsck))
         sessions = sessions.filter(Session.typeOfSession == type)
         return SessionForms(
-                items=[self._copySessionToForm(sess) for sess in \
-                sessions]
+                items=SESSION_SERIALIZER.many(sessions)
         )
 
     @endpoints.method(SESS_SPEAK_REQUEST,SessionForms,
             path='getSessionsBySpeaker',
             http_method='GET',name='getSessionsBySpeaker')
+    @measured
     def getSessionsBySpeaker(self, request):
         """Return sessions for a particular speaker across all conferences."""
-        speak = request.speaker
-        # Camacho - filter sessions by requested speaker
-        sessions = Session.query()
-        sessions = sessions.filter(Session.speaker == speak)
         return SessionForms(
-                items=[self._copySessionToForm(sess) for sess in \
-                sessions]
+                items=SESSION_SERIALIZER.many(
+                    self._getSpeakerSessions(request.speaker))
+        )
+
+    def _getSpeakerSessions(self, name):
+        """Return the sessions of speaker name from the speaker
+        directory, falling back to an exact match on Session.speaker
+        for speakers not yet in it."""
+        speaker, sessions = speakers.sessions(name)
+        if speaker is None:
+            # Camacho - filter sessions by requested speaker
+            sessions = Session.query().filter(Session.speaker == name)
+        return sessions
+
+    @endpoints.method(SPEAKER_PREFIX_REQUEST, SpeakerForms,
+            path='searchSpeakers',
+            http_method='GET', name='searchSpeakers')
+    @measured
+    def searchSpeakers(self, request):
+        """Return speakers whose name starts with prefix, for
+        autocomplete; case and extra whitespace are ignored."""
+        limit = request.limit or speakers.MAX_PREFIX_RESULTS
+        if limit < 1:
+            raise endpoints.BadRequestException("'limit' must be positive")
+        return SpeakerForms(items=[SpeakerForm(
+                name=speaker.key.id(),
+                displayName=speaker.displayName,
+                numSessions=len(speaker.sessionKeys),
+            ) for speaker in speakers.search(request.prefix, limit)]
         )
 
     @endpoints.method(WISH_POST_REQUEST, SessionForms,
             path='addSessionToWishlist',
             http_method='PUT', name='addSessionToWishlist')
+    @measured
     def addSessionToWishlist(self, request):
         """Update wishlist return w/updated info."""
-        return self._addToWishlistObject(request)
-
-    def _addToWishlistObject(self, request):
-        """Add a session to a wishlist, return a wishlist form"""
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        return self._addToWishlistObject([request.sessionKeys])
+
+    @endpoints.method(WishlistForm, SessionForms,
+            path='addSessionsToWishlist',
+            http_method='PUT', name='addSessionsToWishlist')
+    @measured
+    def addSessionsToWishlist(self, request):
+        """Add several sessions to the wishlist; return its sessions."""
+        return self._addToWishlistObject(request.sessionKeys)
+
+    def _getUserWishlist(self):
+        """Return the signed-in user's Wishlist, creating it on first use."""
+        user, user_id = self._currentUser()
+        p_key = ndb.Key(Profile, user_id)
 
         # Camacho - get the user's wishlist
-        wl = Wishlist.query(ancestor=ndb.Key(Profile,user_id))
-        wl = wl.get()
+        wl = ndb.Key(Wishlist, WISHLIST_ID, parent=p_key).get()
+        if not wl:
+            # wishlists made before they had a fixed key name
+            wl = Wishlist.query(ancestor=p_key).get()
 
         # Camacho - make sure the wishlist exists
         if not wl:
-            raise endpoints.NotFoundException(
-                'Your user does not have a wishlist!')
-
-        # Camacho - save the current keys
-        try:
-            currKeys = wl.sessionKeys
-        except:
-            currKeys = []
-
-        # Camacho - get the key specified to add
-        newKey = getattr(request,'sessionKeys')
-
-        # Camacho - make sure the key specified corresponds
-        # to an existing session
-        try:
-            session = ndb.Key(urlsafe=newKey).get()
-        except:
-            raise endpoints.NotFoundException(
-                'Session with this key not found %s' % (newKey))
-
-        currKeys.append(newKey)
-        setattr(wl, 'sessionKeys', currKeys)
-
-        wl.put()
-
-        sessions = []
-
-        # Pass a list of the sessions in the wishlist to the
-        # _copySessionToForm function to return SessionForm
-        # object
-        for k in currKeys:
-            sessions.append(ndb.Key(urlsafe=k).get())
-
+            # creates the Profile (and Wishlist) if there is none
+            self._getProfileFromUser()
+            # a new wishlist is empty, so the counters already agree
+            wl = Wishlist.get_or_insert(WISHLIST_ID, parent=p_key,
+                counted=True)
+        return wl
+
+    def _addToWishlistObject(self, wssks):
+        """Add sessions to a wishlist, return the wishlist's sessions"""
+        wl = self._getUserWishlist()
+        if len(set(wssks)) > MAX_WISHLIST_BATCH:
+            raise endpoints.BadRequestException(
+                'At most %d sessions per request.' % MAX_WISHLIST_BATCH)
+
+        # Camacho - make sure the keys specified correspond
+        # to existing sessions
+        s_keys = []
+        for wssk in wssks:
+            try:
+                s_keys.append(ndb.Key(urlsafe=wssk))
+            except:
+                raise endpoints.NotFoundException(
+                    'Session with this key not found %s' % (wssk))
+        for wssk, session in zip(wssks, ndb.get_multi(s_keys)):
+            if not session:
+                raise endpoints.NotFoundException(
+                    'Session with this key not found %s' % (wssk))
+
+        wl = self._changeWishlistKeys(wl.key, add=wssks)
+
+        # Pass the sessions in the wishlist, fetched in one batch,
+        # to the serializer to return SessionForm objects
+        sessions = ndb.get_multi([ndb.Key(urlsafe=k) for k in wl.sessionKeys])
         return SessionForms(
-                items=[self._copySessionToForm(sess) for sess in \
-                sessions]
+                items=SESSION_SERIALIZER.many([sess for sess in sessions if sess])
         )
 
+    @ndb.transactional(xg=True)
+    def _changeWishlistKeys(self, wl_key, add=(), remove=()):
+        """Add/remove session keys to/from a wishlist with set semantics,
+        counting the wishlist for each session added or removed."""
+        wl = wl_key.get()
+        current = set(wl.sessionKeys)
+        added = []
+        for wssk in add:
+            if wssk not in current:
+                current.add(wssk)
+                added.append(wssk)
+        removed = set(remove).intersection(wl.sessionKeys)
+        if not added and not removed:
+            return wl
+        wl.sessionKeys = [k for k in wl.sessionKeys if k not in removed] + added
+        if wl.counted:
+            for wssk in added:
+                counters.increment(WISHLIST_COUNTER % wssk)
+            for wssk in removed:
+                counters.increment(WISHLIST_COUNTER % wssk, -1)
+        else:
+            # the backfill counts what is in sessionKeys; only take back
+            # what it has counted already
+            for wssk in removed.intersection(wl.countedKeys):
+                counters.increment(WISHLIST_COUNTER % wssk, -1)
+            wl.countedKeys = [k for k in wl.countedKeys if k not in removed]
+        wl.put()
+        return wl
+
     def _copyWishlistToForm(self,wl):
         """Copy wishlist to Form object"""
-        wlForm = WishlistForm()
-        for field in wlForm.all_fields():
-            if hasattr(wl, field.name):
-                setattr(wlForm, field.name, getattr(wl, field.name))
-
-        wlForm.check_initialized()
-        return wlForm
+        return WISHLIST_SERIALIZER.one(wl)
 
     @endpoints.method(message_types.VoidMessage,WishlistForm,
             path='getSessionsInWishlist',
             http_method='GET',name='getSessionsInWishlist')
+    @measured
     def getSessionsInWishlist(self, request):
         """Return sessions for a particular speaker across all conferences."""
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
-
-        # Camacho - get the user's wishlist
-        wl = Wishlist.query(ancestor=ndb.Key(Profile,user_id)).get()
-
-        # Camacho - make sure the wishlist exists
-        if not wl:
-            raise endpoints.NotFoundException(
-                'Your user does not have a wishlist!')
-        return self._copyWishlistToForm(wl)
+        return self._copyWishlistToForm(self._getUserWishlist())
 
     @endpoints.method(WISH_POST_REQUEST,WishlistForm,
             path='deleteSessionInWishlist',
             http_method='DELETE',name='deleteSessionInWishlist')
+    @measured
     def deleteSessionInWishlist(self, request):
         """Delete a single session in the user's wishlist."""
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
-
-        # Camacho - Fetch the user's wishlist
-        wl = Wishlist.query(ancestor=ndb.Key(Profile,user_id))
-        wl = wl.get()
-
-        wlForm = WishlistForm()
-
-        # Camacho - check that conference exists
-        if not wl:
-            raise endpoints.NotFoundException(
-                'Your user does not have a wishlist!')
-
-        # Camacho - save the current keys
-        try:
-            currKeys = wl.sessionKeys
-        except:
-            currKeys = []
+        wl = self._getUserWishlist()
 
         # Camacho - get the requested key to delete
         delKey = getattr(request,'sessionKeys')
 
         # Camacho - make sure the requested key exists
         # in the user's wishlist
-        try:
-            currKeys.remove(delKey)
-        except:
+        if delKey not in wl.sessionKeys:
             raise endpoints.NotFoundException(
                 'Session key not found in wishlist %s' % (delKey))
 
-        setattr(wl, 'sessionKeys', currKeys)
+        wl = self._changeWishlistKeys(wl.key, remove=[delKey])
 
-        wl.put()
+        return self._copyWishlistToForm(wl)
 
+    @endpoints.method(WishlistForm, WishlistForm,
+            path='removeSessionsFromWishlist',
+            http_method='POST', name='removeSessionsFromWishlist')
+    @measured
+    def removeSessionsFromWishlist(self, request):
+        """Remove several sessions from the wishlist; keys not in it
+        are ignored."""
+        wl = self._getUserWishlist()
+        if len(set(request.sessionKeys)) > MAX_WISHLIST_BATCH:
+            raise endpoints.BadRequestException(
+                'At most %d sessions per request.' % MAX_WISHLIST_BATCH)
+        wl = self._changeWishlistKeys(wl.key, remove=request.sessionKeys)
         return self._copyWishlistToForm(wl)
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(FILTER_PLAYGROUND_REQUEST, SessionForms,
             path='filterPlayground',http_method='GET',
             name='filterPlayground')
+    @measured
     def filterPlayground(self, request):
-        """Return filtered conference results"""
+        """Return non-workshop sessions before 7pm, one page at a time"""
+        pageSize, pushed, cursor = self._plannedPageOptions(request)
+
+        # the planner sends the starttime inequality to the datastore
+        # and checks the type in memory
+        plan = self._plan(SESSION_QUERY, [
+            planner.Predicate('typeOfSession', '!=', 'workshop'),
+            planner.Predicate('starttime', '<',
+                SESSION_QUERY.convert['starttime']('19:00')),
+        ], pushed)
+        sessions, next_cursor = self._runPlan(plan, pageSize, cursor)
 
-        q = Session.query(ndb.OR(Session.typeOfSession=='lecture',\
-                         Session.typeOfSession=='workshop')).\
-                    filter(Session.starttime<'19:00')
-
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") for conf in q]
+        return SessionForms(
+            items=SESSION_SERIALIZER.many(sessions),
+            nextCursor=next_cursor
         )
 
+    @staticmethod
+    def _collectPlannerStats():
+        """Refresh the per-field statistics the query planner uses."""
+        planner.collectStats(Conference, CONFERENCE_QUERY.convert.keys())
+        planner.collectStats(Session, SESSION_QUERY.convert.keys())
+
     @endpoints.method(SPEAK_SESS_QUERY, SessionForms,
             path='speakerSessQuery',http_method='GET',
             name='speakerSessQuery')
+    @measured
     def speakerSessQuery(self, request):
         """Return the  sessions of a specific speaker
            and a specific type of session"""
@@ -844,49 +1686,152 @@ class ConferenceApi(remote.Service):
         speaker = request.speaker
         sessType = request.sessionType
 
-        q = Session.query().\
-            filter(Session.speaker == speaker).\
-            filter(Session.typeOfSession == sessType)
+        q = [sess for sess in self._getSpeakerSessions(speaker)
+            if sess.typeOfSession == sessType]
 
         return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in q]
+            items=SESSION_SERIALIZER.many(q)
         )
 
     @endpoints.method(SESS_INFO_REQUEST, StringMessage,
             path='numWishConfsQuery',http_method='GET',
             name='numWishConfsQuery')
+    @measured
     def numWishConfsQuery(self, request):
         """Return number of users who have a particular
            session in their wishlist"""
 
-        wssk = request.wssk
+        # one get_multi of the counter shards kept up to date by
+        # _changeWishlistKeys
+        count = counters.getCount(WISHLIST_COUNTER % request.wssk)
 
-        q = Wishlist.query()
-
-        relevantWls = []
+        if count == 1:
+            return StringMessage(data='There is 1 wishlist with this session')
+        elif count > 1:
+            message = 'There are ' + str(count) + ' wishlists with this session'
+            return StringMessage(data=message)
+        else:
+            return StringMessage(data='There are no wishlists with this session')
 
-        for wlist in q:
-            if wssk in wlist.sessionKeys:
-                relevantWls.append(wlist)
+    @staticmethod
+    def _backfillWishlistCounts(cursor=None):
+        """Count one batch of Wishlists not yet in the per-session
+        wishlist counters; used by the backfill task. Return the cursor
+        of the next batch or None.
+
+        A wishlist records the sessions it was counted for in the same
+        transaction as the increments, and _changeWishlistKeys keeps
+        that record up to date, so the job is safe under live traffic
+        and can be re-run.
+        """
+        wl_keys, next_cursor, more = Wishlist.query().fetch_page(
+            BACKFILL_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+        for wl_key in wl_keys:
+            while not ConferenceApi._countWishlistTxn(wl_key):
+                pass
+        return next_cursor if more else None
 
-        if relevantWls:
-            if len(relevantWls) == 1:
-                return StringMessage(data='There is 1 wishlist with this session')
-            else:
-                message = 'There are ' + str(len(relevantWls)) + ' wishlists with this session'
-                return StringMessage(data=message)
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _countWishlistTxn(wl_key):
+        """Count a Wishlist for up to MAX_WISHLIST_BATCH more of its
+        sessions, one counter shard entity group each; return True once
+        it is counted for all of them."""
+        wl = wl_key.get()
+        if not wl or wl.counted:
+            return True
+        done = set(wl.countedKeys)
+        todo = [wssk for wssk in wl.sessionKeys
+            if wssk not in done][:MAX_WISHLIST_BATCH]
+        for wssk in todo:
+            counters.increment(WISHLIST_COUNTER % wssk)
+        done.update(todo)
+        if done.issuperset(wl.sessionKeys):
+            wl.counted = True
+            wl.countedKeys = []
         else:
-            return StringMessage(data='There are no wishlists with this session')
+            wl.countedKeys.extend(todo)
+        wl.put()
+        return wl.counted
+
+    @staticmethod
+    def _backfillSpeakers(cursor=None):
+        """List one batch of Sessions in the speaker directory; used by
+        the backfill task. Return the cursor of the next batch or None.
+        """
+        sessions, next_cursor, more = Session.query().fetch_page(
+            BACKFILL_BATCH_SIZE, start_cursor=cursor)
+        by_speaker = {}
+        for sess in sessions:
+            norm = speakers.normalize(sess.speaker)
+            if norm:
+                name, s_keys = by_speaker.setdefault(norm, (sess.speaker, []))
+                s_keys.append(sess.key)
+        # addSessions() skips keys already listed, so the job can
+        # safely be re-run
+        for name, s_keys in by_speaker.values():
+            speakers.addSessions(name, s_keys)
+        return next_cursor if more else None
+
+    @staticmethod
+    def _backfillOrganizerNames(cursor=None):
+        """Rewrite one batch of Conferences, filling in missing organizer
+        names, so that organizerDisplayName is indexed for the list
+        projections; used by the backfill task. Return the cursor of the
+        next batch or None.
+        """
+        c_keys, next_cursor, more = Conference.query().fetch_page(
+            BACKFILL_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+        by_organizer = {}
+        for c_key in c_keys:
+            by_organizer.setdefault(c_key.parent(), []).append(c_key)
+
+        # one transaction per organizer's entity group, so concurrent
+        # updates or seat changes aren't clobbered
+        @ndb.transactional()
+        def _rewrite(p_key, keys):
+            confs = [conf for conf in ndb.get_multi(keys) if conf]
+            if any(conf.organizerDisplayName is None for conf in confs):
+                name = getattr(p_key.get(), 'displayName', None)
+                for conf in confs:
+                    if conf.organizerDisplayName is None:
+                        conf.organizerDisplayName = name
+            ndb.put_multi(confs)
+        for p_key, keys in by_organizer.items():
+            _rewrite(p_key, keys)
+            confcache.organizerChanged(p_key.id())
+        return next_cursor if more else None
+
+    @staticmethod
+    def _reindexSearch(kind, cursor=None):
+        """(Re)index one batch of Conferences or Sessions; used by the
+        reindex task. Return the cursor of the next batch or None."""
+        model = Conference if kind == Conference._get_kind() else Session
+        entities, next_cursor, more = model.query().fetch_page(
+            BACKFILL_BATCH_SIZE, start_cursor=cursor)
+        textsearch.index(entities)
+        return next_cursor if more else None
 
     @endpoints.method(CONF_GET_REQUEST,StringMessage,
         path='getFeaturedSpeaker',http_method='GET',
         name='getFeaturedSpeaker')
+    @measured
     def getFeaturedSpeaker(self,request):
-        """Check if speaker is at any other sessions from
-        the same conference, set speaker and session names
-        in memcache"""
-        key = MEMCACHE_SPEAKER_KEY + request.websafeConferenceKey
+        """Return the conference's featured speaker, i.e. the latest
+        speaker with more than one session there, from memcache or the
+        conference's SpeakerIndex"""
+        wsck = request.websafeConferenceKey
+        key = MEMCACHE_SPEAKER_KEY + wsck
         data = memcache.get(key)
+        if data is None:
+            c_key = ndb.Key(urlsafe=wsck)
+            idx = ndb.Key(SpeakerIndex, 1, parent=c_key).get()
+            if idx is None:
+                # a conference from before the index
+                data = self._rebuildSpeakerIndex(c_key) or ''
+            else:
+                data = idx.featured or ''
+            memcache.set(key, data)
         if data:
             return StringMessage(data=repr(data))
         else:
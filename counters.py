@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+"""counters.py
+
+Udacity conference server-side Python App Engine sharded counters
+
+Each named counter is spread over NUM_SHARDS root entities so concurrent
+increments rarely touch the same entity group; reading it back is a
+single get_multi of the shard keys.
+
+"""
+
+import random
+
+from google.appengine.ext import ndb
+
+from models import CounterShard
+
+NUM_SHARDS = 10
+
+
+def _shardKeys(name):
+    """Return the keys of all shards of counter name."""
+    return [ndb.Key(CounterShard, '%s-%d' % (name, i)) for i in range(NUM_SHARDS)]
+
+
+@ndb.tasklet
+def getCountAsync(name):
+    """Return (future of) the current value of counter name."""
+    shards = yield ndb.get_multi_async(_shardKeys(name))
+    raise ndb.Return(sum(shard.count for shard in shards if shard))
+
+
+def getCount(name):
+    """Return the current value of counter name."""
+    return getCountAsync(name).get_result()
+
+
+@ndb.transactional()
+def increment(name, delta=1):
+    """Add delta to counter name; joins the caller's transaction if any."""
+    key = random.choice(_shardKeys(name))
+    shard = key.get() or CounterShard(key=key)
+    shard.count += delta
+    shard.put()
+
+
+@ndb.transactional(xg=True)
+def reset(name, value=0):
+    """Set counter name to value, clearing all other shards."""
+    keys = _shardKeys(name)
+    ndb.delete_multi(keys[1:])
+    CounterShard(key=keys[0], count=value).put()
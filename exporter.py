@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+"""exporter.py
+
+Udacity conference server-side Python App Engine analytics export
+
+An ExportJob snapshots the Conference, Session, Profile and Wishlist
+kinds as gzipped newline-delimited JSON, one object per entity with
+its websafe key under "key". A chain of tasks walks each kind in key
+order with a datastore cursor; each task reads at most CHUNK_ROWS
+entities, or fewer once MAX_CHUNK_BYTES of compressed output is
+reached, so the memory used by a chunk is bounded whatever the size
+of the kind. The job is checkpointed after every chunk, and a retried
+chunk rewrites the same chunk, so an interrupted export resumes where
+it stopped without duplicating rows.
+
+Chunks go to a sink: by default ExportChunk entities below the job,
+which /admin/export/download streams back as one gzip file per kind
+(concatenated gzip members are a valid gzip file); or, when the export
+runs outside App Engine, files in a local directory.
+
+An incremental export only writes the entities whose "updated" time is
+at or after the start of the last finished export, less SKEW to cover
+writes in flight when that export started. Deletions aren't exported.
+
+"""
+
+import base64
+import json
+import os
+import zlib
+from datetime import date
+from datetime import datetime
+from datetime import time
+from datetime import timedelta
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ExportChunk
+from models import ExportJob
+from models import Profile
+from models import Session
+from models import Wishlist
+
+KINDS = (Conference, Session, Profile, Wishlist)
+CHUNK_ROWS = 500
+MAX_CHUNK_BYTES = 900 * 1024    # keeps an ExportChunk under 1MB
+BATCH_SIZE = 100
+SKEW = timedelta(minutes=5)
+
+_MODELS = dict((model._get_kind(), model) for model in KINDS)
+
+
+def _jsonable(value):
+    """Return value as something json.dumps() can write."""
+    if isinstance(value, list):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, dict):
+        return dict((k, _jsonable(v)) for k, v in value.items())
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, ndb.Key):
+        return value.urlsafe()
+    if isinstance(value, str):
+        # BlobProperty values & BlobKeys
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return base64.b64encode(value)
+    return value
+
+
+def _row(entity):
+    """Return the JSON line of entity."""
+    row = _jsonable(entity.to_dict())
+    row['key'] = entity.key.urlsafe()
+    return json.dumps(row, sort_keys=True) + '\n'
+
+
+class ChunkSink(object):
+    """ChunkSink -- stores chunks as ExportChunk entities of the job"""
+
+    def put(self, job, kind, seq, data, rows):
+        ExportChunk(key=chunkKey(job.key, kind, seq),
+            kind=kind, seq=seq, rows=rows, data=data).put()
+
+
+class FileSink(object):
+    """FileSink -- writes chunks to <directory>/<job>/<kind>-<seq>.json.gz"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def put(self, job, kind, seq, data, rows):
+        path = os.path.join(self.directory, str(job.key.id()))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        with open(os.path.join(path, '%s-%06d.json.gz' % (kind, seq)), 'wb') as f:
+            f.write(data)
+
+
+def chunkKey(job_key, kind, seq):
+    """Return the ExportChunk key of chunk seq of kind; ids sort by kind
+    then seq."""
+    return ndb.Key(ExportChunk, '%s-%06d' % (kind, seq), parent=job_key)
+
+
+def sinkFor(job):
+    """Return the sink chunks of job go to."""
+    return FileSink(job.directory) if job.directory else ChunkSink()
+
+
+def lastExport():
+    """Return the most recent finished ExportJob, or None."""
+    return ExportJob.query(ExportJob.status == 'done').\
+        order(-ExportJob.started).get()
+
+
+def start(incremental=False, directory=None):
+    """Create an ExportJob of all KINDS; the caller queues its first
+    chunk. An incremental export with no earlier export is a full one."""
+    last = lastExport() if incremental else None
+    job = ExportJob(kinds=[model._get_kind() for model in KINDS],
+        since=last.started - SKEW if last else None,
+        directory=directory, rows={})
+    job.put()
+    return job
+
+
+def _query(job, model):
+    """Return the query walking model for job."""
+    if job.since is None:
+        return model.query().order(model.key)
+    return model.query(model.updated >= job.since).order(model.updated)
+
+
+def processChunk(job_id):
+    """Export the next chunk of ExportJob job_id; return True if there
+    is more to export."""
+    job = ExportJob.get_by_id(job_id)
+    if not job or job.status != 'running':
+        return False
+    kind = job.kinds[job.kindIndex]
+    cursor = Cursor(urlsafe=job.cursor) if job.cursor else None
+    it = _query(job, _MODELS[kind]).iter(start_cursor=cursor,
+        produce_cursors=True, batch_size=BATCH_SIZE)
+
+    # 31 window bits: write a gzip member rather than a zlib stream
+    gzip = zlib.compressobj(9, zlib.DEFLATED, 31)
+    parts, size, rows = [], 0, 0
+    while rows < CHUNK_ROWS and size < MAX_CHUNK_BYTES and it.has_next():
+        part = gzip.compress(_row(it.next()).encode('utf-8'))
+        rows += 1
+        if part:
+            parts.append(part)
+            size += len(part)
+    more = rows > 0 and it.probably_has_next()
+    next_cursor = it.cursor_after().urlsafe() if more else None
+
+    if rows:
+        parts.append(gzip.flush())
+        sinkFor(job).put(job, kind, job.seq, ''.join(parts), rows)
+    return _checkpoint(job.key, job.kindIndex, job.cursor, next_cursor, rows)
+
+
+@ndb.transactional()
+def _checkpoint(job_key, kindIndex, cursor, next_cursor, rows):
+    """Record a finished chunk on the job; return True if there is more
+    to export."""
+    job = job_key.get()
+    if job.kindIndex != kindIndex or job.cursor != cursor:
+        # a duplicate run of this chunk got here first
+        return job.status == 'running'
+    kind = job.kinds[kindIndex]
+    job.rows = dict(job.rows or {})
+    job.rows[kind] = job.rows.get(kind, 0) + rows
+    if next_cursor:
+        job.cursor = next_cursor
+        job.seq += 1
+    else:
+        job.kindIndex += 1
+        job.cursor = None
+        job.seq = 0
+        if job.kindIndex == len(job.kinds):
+            job.status = 'done'
+    job.put()
+    return job.status == 'running'
+
+
+def chunks(job_key, kind):
+    """Iterate over the ExportChunks of kind of a job, in order."""
+    q = ExportChunk.query(ancestor=job_key).\
+        filter(ExportChunk.key >= chunkKey(job_key, kind, 0)).\
+        filter(ExportChunk.key < ndb.Key(ExportChunk, kind + '.', parent=job_key))
+    # a chunk can be close to 1MB
+    return q.order(ExportChunk.key).iter(batch_size=2)
+
+
+def status(job):
+    """Return a JSON-able summary of job."""
+    return {
+        'id': job.key.id(),
+        'status': job.status,
+        'started': job.started.isoformat() if job.started else None,
+        'since': job.since.isoformat() if job.since else None,
+        'kind': job.kinds[job.kindIndex] if job.status == 'running' else None,
+        'rows': job.rows or {},
+    }
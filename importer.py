@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+
+"""importer.py
+
+Udacity conference server-side Python App Engine bulk import
+
+An admin uploads a newline-delimited JSON or CSV file of conferences
+and sessions to the blobstore, tracked by an ImportJob. A chain of
+tasks each reads the next CHUNK_ROWS lines, checks every row with the
+same rules as createConference/createSession and writes the good rows
+with put_multi; bad rows are skipped and reported on the job.
+
+Before writing, a chunk reserves its key ids, one allocate_ids range
+per parent, and saves them on the job. A retried chunk reuses them and
+so overwrites the same entities rather than duplicating them. The job
+is checkpointed after every chunk, so an interrupted import resumes
+where it stopped.
+
+Rows look like
+
+  {"kind": "conference", "ref": "pycon", "name": "PyCon", "topics": [...]}
+  {"kind": "session", "conference": "pycon", "name": "Keynote", ...}
+
+with the ConferenceForm/SessionForm field names. A session names its
+conference by the ref of a conference earlier in the file, or by
+websafe key in "wsck". CSV files start with a header row of the same
+names, hold one record per line and separate repeated values by ';'.
+
+"""
+
+import csv
+import json
+
+import endpoints
+from protorpc import messages
+
+from google.appengine.api import memcache
+from google.appengine.ext import blobstore
+from google.appengine.ext import ndb
+
+import confcache
+import seats
+import speakers
+import textsearch
+from conference import ConferenceApi
+from conference import MEMCACHE_SPEAKER_KEY
+from models import Conference
+from models import ConferenceForm
+from models import ImportJob
+from models import Profile
+from models import Session
+from models import SessionForm
+
+CHUNK_ROWS = 200
+PUT_BATCH_SIZE = 500    # datastore limit per put
+MAX_ERRORS = 100        # row errors kept on the job
+ROW_KEYS = ('kind', 'ref', 'conference')
+
+
+class RowError(Exception):
+    """RowError -- a row that can't be imported"""
+
+
+def start(blob_key, fmt, organizer):
+    """Create the ImportJob for an uploaded file; the caller queues its
+    first chunk."""
+    job = ImportJob(blobKey=blob_key, format=fmt,
+        organizerUserId=organizer, refs={})
+    job.put()
+    return job
+
+
+def _toForm(message_class, row):
+    """Build a message_class form from the fields of a parsed row."""
+    form = message_class()
+    for name, value in row.items():
+        if name in ROW_KEYS or value in (None, '', []):
+            continue
+        try:
+            field = form.field_by_name(name)
+        except KeyError:
+            raise RowError('unknown field %r' % name)
+        if field.repeated and not isinstance(value, list):
+            value = [v.strip() for v in unicode(value).split(';') if v.strip()]
+        try:
+            if isinstance(field, messages.IntegerField):
+                value = [int(v) for v in value] if field.repeated else int(value)
+            elif isinstance(field, messages.StringField):
+                value = [unicode(v) for v in value] if field.repeated else unicode(value)
+            setattr(form, name, value)
+        except (TypeError, ValueError, messages.ValidationError):
+            raise RowError('bad value for %s: %r' % (name, value))
+    return form
+
+
+def _parse(job, lines):
+    """Return [(line number, row dict or RowError)] for lines; sets
+    job.header from the first line of a CSV file."""
+    rows = []
+    for n, line in enumerate(lines, job.line + 1):
+        if not line.strip():
+            continue
+        try:
+            if job.format == 'csv':
+                values = [v.decode('utf-8') for v in next(csv.reader([line]))]
+                if n == 1:
+                    job.header = [v.strip() for v in values]
+                    continue
+                row = dict(zip(job.header, values))
+            else:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError('not a JSON object')
+        except (ValueError, csv.Error) as e:
+            rows.append((n, RowError('unreadable row: %s' % e)))
+            continue
+        rows.append((n, row))
+    return rows
+
+
+def _check(rows):
+    """Validate rows; return ([(line, kind, conference ref, data)],
+    [error message])."""
+    good, errors = [], []
+    for n, row in rows:
+        try:
+            if isinstance(row, RowError):
+                raise row
+            kind = (row.get('kind') or '').lower()
+            if kind == 'conference':
+                data = ConferenceApi._conferenceData(_toForm(ConferenceForm, row))
+                good.append((n, kind, row.get('ref'), data))
+            elif kind == 'session':
+                data = ConferenceApi._sessionData(_toForm(SessionForm, row))
+                good.append((n, kind, row.get('conference'), data))
+            else:
+                raise RowError("'kind' must be conference or session")
+        except (RowError, endpoints.BadRequestException) as e:
+            errors.append('line %d: %s' % (n, e))
+    return good, errors
+
+
+def _ids(reserved):
+    """Iterate over the ids of a reserved [first, last] range."""
+    return iter(xrange(reserved[0], reserved[1] + 1))
+
+
+def processChunk(job_id):
+    """Import the next chunk of ImportJob job_id; return True if there
+    is more to import."""
+    job = ImportJob.get_by_id(job_id)
+    if not job or job.status != 'running':
+        return False
+    start = job.offset
+    reader = blobstore.BlobReader(job.blobKey, position=start)
+    lines = []
+    while len(lines) < CHUNK_ROWS:
+        line = reader.readline()
+        if not line:
+            break
+        lines.append(line)
+    end = reader.tell()
+
+    p_key = ndb.Key(Profile, job.organizerUserId)
+    profile = p_key.get()
+    if not profile:
+        job.status = 'failed'
+        job.errors.append('organizer %s has no profile' % job.organizerUserId)
+        job.put()
+        return False
+
+    good, errors = _check(_parse(job, lines))
+    confRows = [row for row in good if row[1] == 'conference']
+    reserved = job.reserved if job.reserved and \
+        job.reserved.get('offset') == start else None
+    if reserved is None:
+        reserved = {'offset': start, 'conferences': None, 'sessions': {}}
+        if confRows:
+            reserved['conferences'] = Conference.allocate_ids(
+                size=len(confRows), parent=p_key)
+
+    # conferences: give each its reserved key & record its ref
+    refs = dict(job.refs or {})
+    confs, pools = [], []
+    confIds = _ids(reserved['conferences']) if confRows else None
+    for n, kind, ref, data in confRows:
+        data['key'] = ndb.Key(Conference, next(confIds), parent=p_key)
+        data['organizerUserId'] = job.organizerUserId
+        data['organizerDisplayName'] = profile.displayName
+        if ref:
+            if ref in refs:
+                errors.append('line %d: duplicate ref %r' % (n, ref))
+                continue
+            refs[ref] = data['key'].urlsafe()
+        conf = Conference(**data)
+        confs.append(conf)
+        if data['seatsAvailable'] > 0:
+            pools.extend(seats.createPools(conf, data['seatsAvailable']))
+
+    # sessions: resolve their conference, which must be ours
+    sessRows = []
+    wscks = set(row[3].get('wsck') for row in good
+        if row[1] == 'session' and not row[2] and row[3].get('wsck'))
+    keys = {}
+    for wsck in wscks:
+        try:
+            keys[wsck] = ndb.Key(urlsafe=wsck)
+        except Exception:
+            pass
+    found = dict(zip(keys.keys(), ndb.get_multi(keys.values())))
+    for n, kind, ref, data in good:
+        if kind != 'session':
+            continue
+        if ref:
+            if ref not in refs:
+                errors.append('line %d: unknown conference ref %r' % (n, ref))
+                continue
+            c_key = ndb.Key(urlsafe=refs[ref])
+        else:
+            conf = found.get(data['wsck'])
+            if conf is None:
+                errors.append("line %d: invalid 'wsck' value" % n)
+                continue
+            if conf.organizerUserId != job.organizerUserId:
+                errors.append('line %d: not a conference of %s' % (
+                    n, job.organizerUserId))
+                continue
+            c_key = conf.key
+        sessRows.append((c_key, data))
+    for c_key in set(c_key for c_key, data in sessRows):
+        if c_key.urlsafe() not in reserved['sessions']:
+            reserved['sessions'][c_key.urlsafe()] = Session.allocate_ids(
+                size=sum(1 for k, d in sessRows if k == c_key), parent=c_key)
+    sessIds = dict((wsck, _ids(ids)) for wsck, ids in reserved['sessions'].items())
+    sessions = []
+    for c_key, data in sessRows:
+        data['key'] = ndb.Key(Session, next(sessIds[c_key.urlsafe()]), parent=c_key)
+        data['wsck'] = c_key.urlsafe()
+        sessions.append(Session(**data))
+
+    # checkpoint the reserved ids before writing anything under them
+    if job.reserved != reserved:
+        job.reserved = reserved
+        job.put()
+
+    entities = confs + pools + sessions
+    for i in range(0, len(entities), PUT_BATCH_SIZE):
+        ndb.put_multi(entities[i:i + PUT_BATCH_SIZE])
+
+    # the derived data, all rebuilt idempotently
+    bySpeaker = {}
+    for sess in sessions:
+        norm = speakers.normalize(sess.speaker)
+        if norm:
+            bySpeaker.setdefault(norm, (sess.speaker, []))[1].append(sess.key)
+    for name, s_keys in bySpeaker.values():
+        speakers.addSessions(name, s_keys)
+    for c_key in set(sess.key.parent() for sess in sessions):
+        ConferenceApi._rebuildSpeakerIndex(c_key)
+        memcache.delete(MEMCACHE_SPEAKER_KEY + c_key.urlsafe())
+    textsearch.index(confs + sessions)
+    if confs:
+        confcache.queriesChanged()
+
+    return _checkpoint(job.key, start, end, len(lines), job.header, refs,
+        len(confs), len(sessions), errors)
+
+
+@ndb.transactional()
+def _checkpoint(job_key, start, end, lines, header, refs, confs, sessions, errors):
+    """Record a finished chunk on the job; return True if there is more
+    to import."""
+    job = job_key.get()
+    if job.offset != start:
+        # a duplicate run of this chunk got here first
+        return job.status == 'running'
+    job.offset = end
+    job.line += lines
+    job.header = header
+    job.refs = refs
+    job.reserved = None
+    job.conferences += confs
+    job.sessions += sessions
+    job.failed += len(errors)
+    job.errors = (job.errors + errors)[:MAX_ERRORS]
+    if lines < CHUNK_ROWS:
+        job.status = 'done'
+    job.put()
+    return job.status == 'running'
+
+
+def status(job):
+    """Return a JSON-able summary of job."""
+    return {
+        'id': job.key.id(),
+        'status': job.status,
+        'format': job.format,
+        'organizer': job.organizerUserId,
+        'lines': job.line,
+        'conferences': job.conferences,
+        'sessions': job.sessions,
+        'failed': job.failed,
+        'errors': job.errors,
+    }
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+"""mailer.py
+
+Udacity conference server-side Python App Engine confirmation mail
+
+Creating a conference no longer sends a mail of its own. It adds a
+small task to the MAIL_QUEUE pull queue, tagged with the organizer's
+email address and holding only the conference's websafe key. A cron
+job leases the pending tasks one tag at a time, so each lease is every
+notification waiting for one recipient, and sends that recipient a
+single digest listing their new conferences, read from the datastore
+at send time. Tasks are deleted only after the mail is sent; if
+sending fails their lease runs out and a later run retries them.
+
+Counts of digests and notifications sent, and the size and age of the
+backlog, are reported by stats().
+
+"""
+
+import json
+import logging
+import time
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+MAIL_QUEUE = 'confirmation-mail'
+LEASE_SECONDS = 60
+MAX_LEASE_TASKS = 100       # notifications per digest
+MAX_RETRIES = 5
+RUN_SECONDS = 50            # a run stops leasing after this long
+DIGESTS_KEY = 'MAIL_DIGESTS_SENT'
+NOTIFICATIONS_KEY = 'MAIL_NOTIFICATIONS_SENT'
+FAILURES_KEY = 'MAIL_DIGEST_FAILURES'
+LAST_RUN_KEY = 'MAIL_LAST_RUN'
+
+
+def notifyCreated(email, conf):
+    """Queue the creation confirmation of Conference conf for email."""
+    taskqueue.Queue(MAIL_QUEUE).add(taskqueue.Task(
+        payload=json.dumps({'c': conf.key.urlsafe()}),
+        method='PULL', tag=email))
+
+
+def _digest(confs):
+    """Return the (subject, body) of the digest of Conferences confs."""
+    if len(confs) == 1:
+        subject = 'You created a new Conference!'
+    else:
+        subject = 'You created %d new Conferences!' % len(confs)
+    lines = []
+    for conf in confs:
+        lines.append('%s\r\n  %s, %s to %s\r\n  %s' % (conf.name,
+            conf.city or 'no city', conf.startDate or '?',
+            conf.endDate or '?', conf.key.urlsafe()))
+    return subject, 'Hi, you have created the following ' \
+        'conference%s:\r\n\r\n%s' % ('' if len(confs) == 1 else 's',
+        '\r\n\r\n'.join(lines))
+
+
+def _sendDigest(queue, tasks):
+    """Mail one digest for tasks, which share a recipient tag; return
+    the number of notifications it covered."""
+    email = tasks[0].tag
+    keep = []
+    for task in tasks:
+        if task.retry_count > MAX_RETRIES:
+            logging.error('Dropping confirmation for %s after %d tries',
+                email, task.retry_count)
+        else:
+            keep.append(task)
+    keys = []
+    for task in keep:
+        try:
+            keys.append(ndb.Key(urlsafe=json.loads(task.payload)['c']))
+        except Exception:
+            logging.error('Dropping unreadable confirmation task %s', task.name)
+    # deleted conferences need no confirmation
+    confs = [conf for conf in ndb.get_multi(keys) if conf]
+    if confs:
+        subject, body = _digest(confs)
+        mail.send_mail(
+            'noreply@%s.appspotmail.com' % (
+                app_identity.get_application_id()),     # from
+            email,                                      # to
+            subject,                                    # subj
+            body                                        # body
+        )
+    queue.delete_tasks(tasks)
+    return len(confs)
+
+
+def sendDigests():
+    """Send digests of pending confirmations until the queue is empty or
+    RUN_SECONDS have passed; return (digests, notifications) sent."""
+    queue = taskqueue.Queue(MAIL_QUEUE)
+    started = time.time()
+    digests = notifications = failures = 0
+    while time.time() - started < RUN_SECONDS:
+        # no tag: lease the tasks sharing the tag of the oldest task
+        tasks = queue.lease_tasks_by_tag(LEASE_SECONDS, MAX_LEASE_TASKS)
+        if not tasks:
+            break
+        try:
+            sent = _sendDigest(queue, tasks)
+        except Exception:
+            # leave the tasks leased; they come back when it runs out
+            logging.exception('Confirmation digest to %s failed', tasks[0].tag)
+            failures += 1
+            continue
+        if sent:
+            digests += 1
+            notifications += sent
+    memcache.offset_multi({DIGESTS_KEY: digests,
+        NOTIFICATIONS_KEY: notifications, FAILURES_KEY: failures},
+        initial_value=0)
+    memcache.set(LAST_RUN_KEY, {'at': started, 'digests': digests,
+        'notifications': notifications, 'failures': failures,
+        'seconds': round(time.time() - started, 3)})
+    return digests, notifications
+
+
+def stats():
+    """Return the mail throughput & backlog as a JSON-able dict."""
+    counts = memcache.get_multi([DIGESTS_KEY, NOTIFICATIONS_KEY,
+        FAILURES_KEY, LAST_RUN_KEY])
+    backlog = taskqueue.Queue(MAIL_QUEUE).fetch_statistics()
+    oldest = None
+    if backlog.oldest_eta_usec:
+        oldest = round(time.time() - backlog.oldest_eta_usec / 1e6, 1)
+    return {
+        'digestsSent': counts.get(DIGESTS_KEY, 0),
+        'notificationsSent': counts.get(NOTIFICATIONS_KEY, 0),
+        'failures': counts.get(FAILURES_KEY, 0),
+        'lastRun': counts.get(LAST_RUN_KEY),
+        'backlog': backlog.tasks,
+        'oldestPendingSeconds': oldest,
+        'leasedLastMinute': backlog.executed_last_minute,
+    }
@@ -28,6 +28,7 @@ class Profile(ndb.Model):
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
     sessionWishlist = ndb.StringProperty(repeated=True)
+    updated = ndb.DateTimeProperty(auto_now=True)
 
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
@@ -58,6 +59,9 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    seatShards      = ndb.IntegerProperty(default=0, indexed=False)
+    organizerDisplayName = ndb.StringProperty()
+    updated         = ndb.DateTimeProperty(auto_now=True)
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -77,6 +81,21 @@ class ConferenceForm(messages.Message):
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextCursor = messages.StringField(2)
+
+class ConferenceKeysForm(messages.Message):
+    """ConferenceKeysForm -- multiple websafeConferenceKey inbound form message"""
+    websafeConferenceKeys = messages.StringField(1, repeated=True)
+
+class RegistrationResultForm(messages.Message):
+    """RegistrationResultForm -- per-conference (un)registration outcome message"""
+    websafeConferenceKey = messages.StringField(1)
+    success = messages.BooleanField(2)
+    error = messages.StringField(3)
+
+class RegistrationResultForms(messages.Message):
+    """RegistrationResultForms -- multiple RegistrationResultForm outbound form message"""
+    items = messages.MessageField(RegistrationResultForm, 1, repeated=True)
 
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
@@ -105,6 +124,16 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    cursor = messages.StringField(3)
+    fieldMask = messages.StringField(4)
+
+class SessionQueryForms(messages.Message):
+    """SessionQueryForms -- Session query inbound form message"""
+    filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    cursor = messages.StringField(3)
+    websafeConferenceKey = messages.StringField(4)
 
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
@@ -122,6 +151,7 @@ class Session(ndb.Model):
     typeOfSession = ndb.StringProperty()
     date          = ndb.DateProperty()
     starttime     = ndb.TimeProperty()
+    updated       = ndb.DateTimeProperty(auto_now=True)
 
 class SessionForm(messages.Message):
     """SessionForm -- Conference Session inbound form message"""
@@ -133,16 +163,99 @@ class SessionForm(messages.Message):
     typeOfSession = messages.StringField(6)
     date          = messages.StringField(7)
     starttime     = messages.StringField(8)
+    websafeKey    = messages.StringField(9)
 
 class SessionForms(messages.Message):
     """SessionForm -- multiple outbound Session Form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextCursor = messages.StringField(2)
+
+class SessionConflictForm(messages.Message):
+    """SessionConflictForm -- two sessions whose times overlap"""
+    first  = messages.MessageField(SessionForm, 1)
+    second = messages.MessageField(SessionForm, 2)
+
+class SessionConflictForms(messages.Message):
+    """SessionConflictForms -- multiple SessionConflictForm outbound form message"""
+    items = messages.MessageField(SessionConflictForm, 1, repeated=True)
 
 class Wishlist(ndb.Model):
     """Wishlist -- user session wishlist object"""
     sessionKeys = ndb.StringProperty(repeated=True)
+    # whether the per-session wishlist counters include this wishlist;
+    # until they do, countedKeys are the sessions the backfill has
+    # counted it for so far
+    counted = ndb.BooleanProperty(default=False, indexed=False)
+    countedKeys = ndb.StringProperty(repeated=True, indexed=False)
+    updated = ndb.DateTimeProperty(auto_now=True)
 
 class WishlistForm(messages.Message):
     """WishlistForm -- User Wishlist inbound form message"""
     sessionKeys = messages.StringField(1, repeated=True)
 
+
+class CounterShard(ndb.Model):
+    """CounterShard -- one shard of a sharded counter"""
+    count = ndb.IntegerProperty(default=0, indexed=False)
+
+class SeatShard(ndb.Model):
+    """SeatShard -- one pool of a Conference's free seats"""
+    seatsAvailable = ndb.IntegerProperty(default=0, indexed=False)
+
+class SpeakerIndex(ndb.Model):
+    """SpeakerIndex -- a Conference's speaker -> session names index"""
+    sessions = ndb.JsonProperty()
+    featured = ndb.StringProperty(indexed=False)
+
+class Speaker(ndb.Model):
+    """Speaker -- a speaker's sessions across all conferences, keyed by
+    the normalized speaker name"""
+    displayName = ndb.StringProperty(indexed=False)
+    sessionKeys = ndb.KeyProperty(kind=Session, repeated=True, indexed=False)
+
+class SpeakerForm(messages.Message):
+    """SpeakerForm -- Speaker outbound form message"""
+    name        = messages.StringField(1)
+    displayName = messages.StringField(2)
+    numSessions = messages.IntegerField(3)
+
+class SpeakerForms(messages.Message):
+    """SpeakerForms -- multiple Speaker outbound form message"""
+    items = messages.MessageField(SpeakerForm, 1, repeated=True)
+
+class ImportJob(ndb.Model):
+    """ImportJob -- progress of one bulk import upload"""
+    blobKey         = ndb.BlobKeyProperty(indexed=False)
+    format          = ndb.StringProperty(choices=['ndjson', 'csv'], indexed=False)
+    organizerUserId = ndb.StringProperty(indexed=False)
+    status          = ndb.StringProperty(default='running')
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+    offset          = ndb.IntegerProperty(default=0, indexed=False)
+    line            = ndb.IntegerProperty(default=0, indexed=False)
+    header          = ndb.StringProperty(repeated=True, indexed=False)
+    refs            = ndb.JsonProperty()
+    reserved        = ndb.JsonProperty()
+    conferences     = ndb.IntegerProperty(default=0, indexed=False)
+    sessions        = ndb.IntegerProperty(default=0, indexed=False)
+    failed          = ndb.IntegerProperty(default=0, indexed=False)
+    errors          = ndb.StringProperty(repeated=True, indexed=False)
+
+class ExportJob(ndb.Model):
+    """ExportJob -- progress of one export of all exported kinds"""
+    status      = ndb.StringProperty(default='running')
+    started     = ndb.DateTimeProperty(auto_now_add=True)
+    since       = ndb.DateTimeProperty(indexed=False)
+    directory   = ndb.StringProperty(indexed=False)  # local sink, if any
+    kinds       = ndb.StringProperty(repeated=True, indexed=False)
+    kindIndex   = ndb.IntegerProperty(default=0, indexed=False)
+    cursor      = ndb.StringProperty(indexed=False)
+    seq         = ndb.IntegerProperty(default=0, indexed=False)
+    rows        = ndb.JsonProperty()
+
+class ExportChunk(ndb.Model):
+    """ExportChunk -- gzipped newline-delimited JSON rows of one kind,
+    child of its ExportJob"""
+    kind = ndb.StringProperty(indexed=False)
+    seq  = ndb.IntegerProperty(indexed=False)
+    rows = ndb.IntegerProperty(indexed=False)
+    data = ndb.BlobProperty()
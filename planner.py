@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+
+"""planner.py
+
+Udacity conference server-side Python App Engine query planner
+
+The datastore serves at most one inequality property per query, can't
+page through OR/IN or != queries with a cursor, and needs a composite
+index for most mixes of filters. The planner splits the requested
+predicates into the set it sends to the datastore and a residual set
+it checks in memory. Of the datastore-servable sets it picks the one
+expected to scan the fewest entities, estimated from per-field
+statistics (distinct values, min & max) where collectStats() has
+gathered them, and from fixed guesses otherwise.
+
+run() streams batches of the chosen query through the residual filter
+until the page is full, and gives up with TooManyScanned after
+MAX_SCANNED entities, so a poor plan fails fast instead of reading the
+whole kind.
+
+A datastore cursor only continues the query it came from, but the
+chosen plan can change between pages as statistics are refreshed.
+encodeCursor() therefore tags a cursor with the predicates its plan
+pushed, and plan(pushed=...) rebuilds exactly that plan for the next
+page. The tags are indices, so callers put predicates in canonical()
+order first; a cursor then fits the same filters in any order.
+
+"""
+
+import itertools
+from datetime import date
+from datetime import time
+
+from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+INEQUALITIES = ('<', '<=', '>', '>=')
+MAX_SCANNED = 1000
+MIN_BATCH_SIZE = 20
+MAX_BATCH_SIZE = 200
+STATS_KEY = 'PLANNER_STATS_%s'
+STATS_LIMIT = 1000      # distinct values counted per field
+STATS_TTL = 2 * 24 * 60 * 60
+
+# selectivity guesses for fields without statistics
+GUESS_EQUALITY = 0.1
+GUESS_RANGE = 0.33
+GUESS_NOT_EQUAL = 0.9
+
+
+class TooManyScanned(Exception):
+    """TooManyScanned -- the plan read MAX_SCANNED entities before
+    filling the page"""
+
+
+class Spec(object):
+    """Spec -- what the planner may do with the queries of one kind
+
+    convert maps the property names that may be filtered on to
+    functions turning a request string into a property value. order
+    lists the properties results are sorted by after any pushed
+    inequality. composites lists the (equality properties, inequality
+    property or None) combinations index.yaml has composite indexes
+    for; None means every combination is indexed.
+    """
+
+    def __init__(self, model, convert, order=(), composites=None):
+        self.model = model
+        self.convert = convert
+        self.order = tuple(order)
+        self.composites = None if composites is None else set(
+            (frozenset(eqs), ineq) for eqs, ineq in composites)
+
+    def indexed(self, eqs, ineq, ancestor):
+        """Whether equality filters on eqs plus inequality ineq (None
+        for none) can be served by the indexes we have."""
+        if not self.order and ineq is None:
+            # merge join over the built-in single property indexes
+            return True
+        if not eqs and not ancestor and self.order in ((), (ineq,)):
+            return True
+        if ancestor:
+            return False
+        return self.composites is None or \
+            (frozenset(eqs), ineq) in self.composites
+
+
+class Predicate(object):
+    """Predicate -- field op value, where op is one of = != < <= > >=
+    or IN (value is then a list)"""
+
+    def __init__(self, field, op, value):
+        self.field = field
+        self.op = op
+        self.value = value
+
+    def matches(self, entity):
+        """Check the predicate in memory; a repeated property matches
+        if any of its values does, as in the datastore."""
+        values = getattr(entity, self.field)
+        if not isinstance(values, list):
+            values = [values]
+        return any(self._test(value) for value in values)
+
+    def _test(self, value):
+        if self.op == '=':
+            return value == self.value
+        if self.op == 'IN':
+            return value in self.value
+        if self.op == '!=':
+            return value != self.value
+        if value is None:
+            # the datastore never returns None for an inequality
+            return False
+        if self.op == '<':
+            return value < self.value
+        if self.op == '<=':
+            return value <= self.value
+        if self.op == '>':
+            return value > self.value
+        return value >= self.value
+
+    def node(self):
+        """Return the ndb FilterNode of a pushable predicate."""
+        return ndb.query.FilterNode(self.field, self.op, self.value)
+
+
+def _number(value):
+    """Map a property value onto a number for range estimates, or
+    None if it has no natural scale."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, long, float)):
+        return value
+    if isinstance(value, date):
+        return value.toordinal()
+    if isinstance(value, time):
+        return value.hour * 3600 + value.minute * 60 + value.second
+    return None
+
+
+def _selectivity(preds, stats):
+    """Estimate the fraction of entities matching all of preds."""
+    fraction = 1.0
+    for field, group in itertools.groupby(
+            sorted(preds, key=lambda pred: pred.field),
+            key=lambda pred: pred.field):
+        group = list(group)
+        field_stats = stats.get(field) or {}
+        distinct = field_stats.get('distinct')
+        low, high = _number(field_stats.get('min')), \
+            _number(field_stats.get('max'))
+        for pred in group:
+            if pred.op == '=':
+                fraction *= 1.0 / distinct if distinct else GUESS_EQUALITY
+            elif pred.op == 'IN':
+                fraction *= min(1.0, len(pred.value) *
+                    (1.0 / distinct if distinct else GUESS_EQUALITY))
+            elif pred.op == '!=':
+                fraction *= 1.0 - 1.0 / distinct if distinct else GUESS_NOT_EQUAL
+        ranges = [pred for pred in group if pred.op in INEQUALITIES]
+        if not ranges:
+            continue
+        value_range = [low, high]
+        if None in value_range or high <= low:
+            fraction *= GUESS_RANGE ** min(len(ranges), 2)
+            continue
+        for pred in ranges:
+            bound = _number(pred.value)
+            if bound is None:
+                continue
+            if pred.op in ('<', '<='):
+                value_range[1] = min(value_range[1], bound)
+            else:
+                value_range[0] = max(value_range[0], bound)
+        fraction *= max(0.0, float(value_range[1] - value_range[0])) / (high - low)
+    return fraction
+
+
+class Plan(object):
+    """Plan -- a datastore query plus the predicates left to check in
+    memory"""
+
+    def __init__(self, spec, preds, pushed, residual, ineq, ancestor, stats):
+        self.spec = spec
+        self.preds = preds
+        self.pushed = pushed
+        self.residual = residual
+        self.ineq = ineq
+        self.ancestor = ancestor
+        # share of the kind the query reads, and of those the share
+        # that passes the residual predicates
+        self.estimate = _selectivity(pushed, stats)
+        self.passing = _selectivity(residual, stats)
+
+    def query(self):
+        """Return the ndb query of the plan."""
+        q = self.spec.model.query(ancestor=self.ancestor)
+        for pred in self.pushed:
+            q = q.filter(pred.node())
+        # the datastore wants an inequality property sorted first
+        order = ((self.ineq,) if self.ineq else ()) + \
+            tuple(prop for prop in self.spec.order if prop != self.ineq)
+        for prop in order:
+            q = q.order(ndb.GenericProperty(prop))
+        return q
+
+    def describe(self):
+        """Return a short text form of the plan, for logs."""
+        show = lambda preds: ' AND '.join('%s %s %r' % (pred.field,
+            pred.op, pred.value) for pred in preds) or '-'
+        return 'datastore: %s; in memory: %s; est. %.3f' % (
+            show(self.pushed), show(self.residual), self.estimate)
+
+
+def plan(spec, preds, stats=None, ancestor=None, pushed=None):
+    """Choose how to run preds against spec's kind, optionally below
+    ancestor; stats are per-field statistics as from getStats().
+
+    pushed, the predicate indices from decodeCursor(), rebuilds the plan
+    a cursor came from instead of choosing one. Raises ValueError if
+    those predicates can't be pushed together.
+    """
+    stats = stats or {}
+    if pushed is not None:
+        return _rebuild(spec, preds, pushed, stats, ancestor)
+    eqs = [pred for pred in preds if pred.op == '=']
+    eq_fields = sorted(set(pred.field for pred in eqs))
+    ineq_fields = sorted(set(pred.field for pred in preds
+        if pred.op in INEQUALITIES))
+    best = None
+    for ineq in [None] + ineq_fields:
+        # largest equality subsets first; each equality filter we can
+        # push only narrows the scan
+        for size in range(len(eq_fields), -1, -1):
+            for subset in itertools.combinations(eq_fields, size):
+                if not spec.indexed(subset, ineq, ancestor is not None):
+                    continue
+                pushed = [pred for pred in eqs if pred.field in subset] + \
+                    [pred for pred in preds
+                        if pred.field == ineq and pred.op in INEQUALITIES]
+                residual = [pred for pred in preds
+                    if not any(pred is other for other in pushed)]
+                candidate = Plan(spec, preds, pushed, residual, ineq,
+                    ancestor, stats)
+                if best is None or (candidate.estimate, len(residual)) < \
+                        (best.estimate, len(best.residual)):
+                    best = candidate
+    return best
+
+
+def canonical(preds):
+    """Return preds sorted & deduplicated, so that equivalent queries
+    list the same predicates in the same order and the indices in a
+    cursor from encodeCursor() mean the same for all of them."""
+    terms = {}
+    for pred in preds:
+        value = tuple(sorted(set(pred.value))) if pred.op == 'IN' else pred.value
+        terms.setdefault((pred.field, pred.op, value), pred)
+    return [terms[term] for term in sorted(terms)]
+
+
+def _rebuild(spec, preds, pushed, stats, ancestor):
+    """Return the Plan pushing the predicates at indices pushed of
+    preds, in the order plan() would push them."""
+    if len(set(pushed)) != len(pushed) or \
+            not all(0 <= i < len(preds) for i in pushed):
+        raise ValueError('Pushed predicates out of range.')
+    chosen = [preds[i] for i in sorted(pushed)]
+    if any(pred.op != '=' and pred.op not in INEQUALITIES for pred in chosen):
+        raise ValueError('Only = and range predicates can be pushed.')
+    ineq_fields = set(pred.field for pred in chosen if pred.op in INEQUALITIES)
+    if len(ineq_fields) > 1:
+        raise ValueError('Range predicates on more than one field.')
+    ineq = ineq_fields.pop() if ineq_fields else None
+    eq_fields = sorted(set(pred.field for pred in chosen if pred.op == '='))
+    if not spec.indexed(eq_fields, ineq, ancestor is not None):
+        raise ValueError('No index for the pushed predicates.')
+    chosen = [pred for pred in chosen if pred.op == '='] + \
+        [pred for pred in chosen if pred.op in INEQUALITIES]
+    residual = [pred for i, pred in enumerate(preds) if i not in pushed]
+    return Plan(spec, preds, chosen, residual, ineq, ancestor, stats)
+
+
+def encodeCursor(plan, cursor):
+    """Return a urlsafe token of cursor that also names the predicates
+    plan pushed, for decodeCursor()."""
+    indices = [str(i) for i, pred in enumerate(plan.preds)
+        if any(pred is other for other in plan.pushed)]
+    return '%s.%s' % (','.join(indices), cursor.urlsafe())
+
+
+def decodeCursor(token):
+    """Return (pushed predicate indices, ndb Cursor) of a token from
+    encodeCursor(). Raises ValueError if it isn't one."""
+    head, dot, urlsafe = token.partition('.')
+    if not dot or not urlsafe:
+        raise ValueError('Not a planner cursor.')
+    pushed = [int(i) for i in head.split(',')] if head else []
+    try:
+        return pushed, ndb.Cursor(urlsafe=urlsafe)
+    except datastore_errors.BadValueError:
+        raise ValueError('Invalid datastore cursor.')
+
+
+def run(plan, limit, cursor=None, max_scanned=MAX_SCANNED, projection=None):
+    """Fetch one page of plan's matches, optionally as a projection
+    (which must cover any residual predicates).
+
+    Returns (entities, next cursor, more) like fetch_page(). Raises
+    TooManyScanned if max_scanned entities are read before the page is
+    full.
+    """
+    # expect to read limit / (share passing the residual) entities
+    batch_size = int(limit / (plan.passing or GUESS_RANGE)) + 1
+    batch_size = max(MIN_BATCH_SIZE, min(MAX_BATCH_SIZE, batch_size))
+    it = plan.query().iter(start_cursor=cursor, produce_cursors=True,
+        batch_size=batch_size, projection=projection)
+    results = []
+    scanned = 0
+    while len(results) < limit and it.has_next():
+        entity = it.next()
+        scanned += 1
+        if all(pred.matches(entity) for pred in plan.residual):
+            results.append(entity)
+        elif scanned >= max_scanned:
+            raise TooManyScanned(plan.describe())
+    if not scanned:
+        return results, None, False
+    return results, it.cursor_after(), it.probably_has_next()
+
+
+def getStats(model):
+    """Return the per-field statistics of model last collected, or {}."""
+    return memcache.get(STATS_KEY % model._get_kind()) or {}
+
+
+def collectStats(model, fields):
+    """Gather {field: {distinct, min, max}} for the indexed properties
+    fields of model with projection queries, and cache it for plan()."""
+    stats = {}
+    for field in fields:
+        prop = model._properties[field]
+        distinct = model.query(projection=[prop], distinct=True).fetch(
+            STATS_LIMIT)
+        lowest = model.query(projection=[prop]).order(prop).get()
+        highest = model.query(projection=[prop]).order(-prop).get()
+        stats[field] = {
+            # a capped count still says the field is selective
+            'distinct': len(distinct),
+            'min': getattr(lowest, field, None),
+            'max': getattr(highest, field, None),
+        }
+    memcache.set(STATS_KEY % model._get_kind(), stats, time=STATS_TTL)
+    return stats
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+
+"""rpcstats.py
+
+Udacity conference server-side Python App Engine RPC accounting;
+    counts datastore & memcache RPCs and round-trips per endpoint call
+    and times it
+
+An RPC that is issued while no other RPC is outstanding starts a new
+round-trip; RPCs issued while others are still in flight (e.g. from
+parallel tasklets) ride along in the same round-trip. The difference
+between calls and round-trips is what overlapping the RPCs saved.
+
+Besides the per-process totals, each instance adds up its calls'
+counts and a latency histogram in memory and, every FLUSH_EVERY calls
+or FLUSH_SECONDS, adds them to memcache counters with one offset_multi.
+An instance writes to one of NUM_SHARDS sets of counters, picked at
+random when it starts, so busy instances don't all increment the same
+keys; metrics() adds the shards up. Counts lost to memcache eviction
+only make the numbers low, so this is for watching, not billing.
+
+"""
+
+import bisect
+import functools
+import logging
+import random
+import threading
+import time
+
+import webapp2
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+COUNTED_SERVICES = ('datastore_v3', 'memcache')
+# upper bounds (ms) of the latency histogram buckets; the last bucket
+# holds everything slower
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+# datastore calls by what they do; anything else counts as "other"
+CATEGORIES = {
+    'datastore_v3.Get': 'gets',
+    'datastore_v3.RunQuery': 'queries',
+    'datastore_v3.Next': 'queries',
+    'datastore_v3.Put': 'puts',
+    'datastore_v3.Delete': 'deletes',
+    'datastore_v3.BeginTransaction': 'transactions',
+    'datastore_v3.Commit': 'transactions',
+    'datastore_v3.Rollback': 'transactions',
+}
+FIELDS = ('requests', 'errors', 'ms', 'calls', 'roundTrips', 'entities',
+    'gets', 'queries', 'puts', 'deletes', 'transactions', 'memcache',
+    'other') + \
+    tuple('le%d' % bound for bound in BUCKETS_MS) + ('inf',)
+NUM_SHARDS = 8
+METRIC_KEY = 'RPCSTATS_%d_%s_%s'    # shard, name, field
+FLUSH_EVERY = 50
+FLUSH_SECONDS = 10
+GET_BATCH_SIZE = 1000
+PERCENTILES = (50, 95, 99)
+
+_local = threading.local()
+_lock = threading.Lock()
+_hooked = None      # the apiproxy our hooks were installed on
+_totals = {}        # name -> [requests, calls, roundTrips, byMethod, entities]
+_names = set()      # names of measured functions
+_shard = random.randrange(NUM_SHARDS)
+_unflushed = {}     # name -> {field: count} not yet in memcache
+_pending = [0, time.time()]     # calls since last flush, its time
+
+
+class RpcStats(object):
+    """RpcStats -- RPC counts for a single measured call"""
+    def __init__(self):
+        self.calls = 0
+        self.roundTrips = 0
+        self.inFlight = 0
+        self.byMethod = {}
+        self.entities = 0
+        self.ms = 0.0
+        self.failed = False
+
+    @property
+    def saved(self):
+        """Round-trips saved by issuing RPCs concurrently."""
+        return self.calls - self.roundTrips
+
+
+def _preCall(service, call, request, response):
+    stats = getattr(_local, 'stats', None)
+    if stats is None or service not in COUNTED_SERVICES:
+        return
+    if stats.inFlight == 0:
+        stats.roundTrips += 1
+    stats.inFlight += 1
+    stats.calls += 1
+    name = '%s.%s' % (service, call)
+    stats.byMethod[name] = stats.byMethod.get(name, 0) + 1
+
+
+def _postCall(service, call, request, response):
+    stats = getattr(_local, 'stats', None)
+    if stats is None or service not in COUNTED_SERVICES:
+        return
+    stats.inFlight = max(0, stats.inFlight - 1)
+    if service == 'datastore_v3':
+        stats.entities += _entitiesRead(call, response)
+
+
+def _entitiesRead(call, response):
+    """Return the number of entities (or keys, or projections) a
+    datastore response carries."""
+    if call == 'Get':
+        return sum(1 for found in response.entity_list() if found.has_entity())
+    if call in ('RunQuery', 'Next'):
+        return response.result_size()
+    return 0
+
+
+def install():
+    """Install the RPC hooks on the current apiproxy (idempotent)."""
+    global _hooked
+    apiproxy = apiproxy_stub_map.apiproxy
+    if _hooked is apiproxy:
+        return
+    apiproxy.GetPreCallHooks().Append('rpcstats', _preCall)
+    apiproxy.GetPostCallHooks().Append('rpcstats', _postCall)
+    _hooked = apiproxy
+
+
+def current():
+    """Return the RpcStats being collected on this thread, or None."""
+    return getattr(_local, 'stats', None)
+
+
+def measure(name, func, *args, **kwargs):
+    """Call func, counting its RPCs & time under name."""
+    if current() is not None:
+        # nested measured call; outermost one does the accounting
+        return func(*args, **kwargs)
+    install()
+    stats = _local.stats = RpcStats()
+    started = time.time()
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        stats.failed = True
+        raise
+    finally:
+        stats.ms = (time.time() - started) * 1000
+        _local.stats = None
+        record(name, stats)
+
+
+def measured(func):
+    """Decorator counting the RPCs & round-trips made by func and
+    timing it; the numbers are logged and added to the totals."""
+    _names.add(func.__name__)
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return measure(func.__name__, func, *args, **kwargs)
+    return wrapper
+
+
+class MeasuredHandler(webapp2.RequestHandler):
+    """MeasuredHandler -- RequestHandler whose requests are measured
+    under the handler's class name"""
+
+    def dispatch(self):
+        return measure(type(self).__name__,
+            super(MeasuredHandler, self).dispatch)
+
+
+def _handlerNames(cls=MeasuredHandler):
+    """Return the class names of all MeasuredHandler subclasses."""
+    names = set()
+    for sub in cls.__subclasses__():
+        names.add(sub.__name__)
+        names |= _handlerNames(sub)
+    return names
+
+
+def _bucket(ms):
+    """Return the histogram field of a latency of ms."""
+    i = bisect.bisect_left(BUCKETS_MS, ms)
+    return 'le%d' % BUCKETS_MS[i] if i < len(BUCKETS_MS) else 'inf'
+
+
+def record(name, stats):
+    """Log stats for one call of name & add them to the totals."""
+    logging.debug('%s: %.1fms, %d RPCs in %d round-trips (%d saved), '
+        '%d entities read %r', name, stats.ms, stats.calls, stats.roundTrips,
+        stats.saved, stats.entities, stats.byMethod)
+    with _lock:
+        total = _totals.setdefault(name, [0, 0, 0, {}, 0])
+        total[0] += 1
+        total[1] += stats.calls
+        total[2] += stats.roundTrips
+        total[4] += stats.entities
+        for method, count in stats.byMethod.items():
+            total[3][method] = total[3].get(method, 0) + count
+
+        counts = _unflushed.setdefault(name, {})
+        for field, n in _fields(stats).items():
+            counts[field] = counts.get(field, 0) + n
+        _pending[0] += 1
+        if _pending[0] < FLUSH_EVERY and \
+                time.time() - _pending[1] < FLUSH_SECONDS:
+            return
+        deltas = dict((METRIC_KEY % (_shard, name, field), n)
+            for name, counts in _unflushed.items()
+            for field, n in counts.items() if n)
+        _unflushed.clear()
+        _pending[:] = [0, time.time()]
+    flush(deltas)
+
+
+def _fields(stats):
+    """Return the metric counts of one call."""
+    fields = {'requests': 1, 'ms': int(round(stats.ms)),
+        'calls': stats.calls, 'roundTrips': stats.roundTrips,
+        'entities': stats.entities, _bucket(stats.ms): 1}
+    if stats.failed:
+        fields['errors'] = 1
+    for method, count in stats.byMethod.items():
+        if method.startswith('memcache.'):
+            category = 'memcache'
+        else:
+            category = CATEGORIES.get(method, 'other')
+        fields[category] = fields.get(category, 0) + count
+    return fields
+
+
+def flush(deltas):
+    """Add deltas {memcache key: count} to the memcache counters."""
+    if not deltas:
+        return
+    try:
+        memcache.offset_multi(deltas, initial_value=0)
+    except Exception:
+        # metrics must never fail the request
+        logging.exception('Flushing RPC metrics failed')
+
+
+def _percentile(histogram, requests, pct):
+    """Return the upper bound (ms) of the bucket holding the pct-th
+    percentile call, None if it's in the last bucket."""
+    rank = requests * pct / 100.0
+    seen = 0
+    for bound, count in histogram:
+        seen += count
+        if seen >= rank:
+            return bound
+    return None
+
+
+def metrics():
+    """Return {name: {field: count, ..., meanMs, pNNMs, histogram}}
+    summed over all shards in memcache, for the names measured in this
+    process."""
+    names = sorted(_names | _handlerNames())
+    keys = [METRIC_KEY % (shard, name, field)
+        for name in names for shard in range(NUM_SHARDS) for field in FIELDS]
+    values = {}
+    for i in range(0, len(keys), GET_BATCH_SIZE):
+        values.update(memcache.get_multi(keys[i:i + GET_BATCH_SIZE]))
+    result = {}
+    for name in names:
+        counts = dict((field, sum(values.get(METRIC_KEY % (shard, name, field), 0)
+            for shard in range(NUM_SHARDS))) for field in FIELDS)
+        if not counts['requests']:
+            continue
+        counts['meanMs'] = round(float(counts['ms']) / counts['requests'], 1)
+        counts['histogram'] = [[bound, counts.pop('le%d' % bound)]
+            for bound in BUCKETS_MS] + [[None, counts.pop('inf')]]
+        for pct in PERCENTILES:
+            counts['p%dMs' % pct] = _percentile(counts['histogram'],
+                counts['requests'], pct)
+        result[name] = counts
+    return result
+
+
+def totals():
+    """Return {name: {requests, calls, roundTrips, saved, entities,
+    byMethod}} for this process."""
+    with _lock:
+        return dict((name, {
+                'requests': t[0],
+                'calls': t[1],
+                'roundTrips': t[2],
+                'saved': t[1] - t[2],
+                'entities': t[4],
+                'byMethod': dict(t[3]),
+            }) for name, t in _totals.items())
+
+
+def reset():
+    """Clear the per-process totals and unflushed metrics."""
+    with _lock:
+        _totals.clear()
+        _unflushed.clear()
+        _pending[:] = [0, time.time()]
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""schedule.py
+
+Udacity conference server-side Python App Engine session scheduling
+
+A session occupies [date + starttime, + duration). Overlaps between
+many sessions are found with a sweep over the sessions in start order,
+keeping the ones still running in a heap ordered by end time: each
+session conflicts exactly with those still running when it starts, so
+the cost is O(n log n) plus the number of conflicts rather than a
+comparison of every pair.
+
+"""
+
+import heapq
+import re
+from datetime import datetime
+from datetime import timedelta
+
+# "90", "90 min", "1:30", "1h30", "1.5 h", "2 hours"
+_MINUTES = re.compile(r'^\s*(\d+)\s*(m|min|mins|minutes)?\s*$', re.I)
+_CLOCK = re.compile(r'^\s*(\d+):(\d{1,2})\s*$')
+_HOURS = re.compile(
+    r'^\s*(\d+(?:\.\d+)?)\s*(h|hr|hrs|hour|hours)\s*(?:(\d+)\s*(m|min|mins|minutes)?)?\s*$',
+    re.I)
+
+
+def durationMinutes(text):
+    """Parse a Session.duration string into minutes; None if it can't
+    be understood."""
+    if not text:
+        return None
+    match = _MINUTES.match(text)
+    if match:
+        return int(match.group(1))
+    match = _CLOCK.match(text)
+    if match:
+        return int(match.group(1)) * 60 + int(match.group(2))
+    match = _HOURS.match(text)
+    if match:
+        return int(round(float(match.group(1)) * 60)) + int(match.group(3) or 0)
+    return None
+
+
+def interval(sess):
+    """Return the (start, end) datetimes of sess, or None if its date,
+    start time or duration is missing or unreadable."""
+    minutes = durationMinutes(sess.duration)
+    if not sess.date or sess.starttime is None or not minutes:
+        return None
+    start = datetime.combine(sess.date, sess.starttime)
+    return start, start + timedelta(minutes=minutes)
+
+
+def conflicts(sessions):
+    """Return the (earlier, later) pairs of sessions whose times
+    overlap; sessions without a full interval() are ignored."""
+    timed = []
+    for sess in sessions:
+        span = interval(sess)
+        if span:
+            timed.append((span, sess))
+    timed.sort(key=lambda item: item[0])
+    running = []    # heap of (end, n, session)
+    pairs = []
+    for n, ((start, end), sess) in enumerate(timed):
+        # sessions ending when this one starts don't overlap it
+        while running and running[0][0] <= start:
+            heapq.heappop(running)
+        pairs.extend((other, sess) for other_end, m, other in sorted(running))
+        heapq.heappush(running, (end, n, sess))
+    return pairs
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+"""seats.py
+
+Udacity conference server-side Python App Engine seat reservation
+
+A Conference's free seats are split over several SeatShard pools, each
+its own entity group. A registration decrements one randomly chosen
+pool inside the registrant's transaction, so concurrent registrants
+rarely contend, and no pool ever drops below zero, so seats are never
+oversold. A registrant that keeps losing the race for random pools
+falls back to trying every pool with seats in turn, so a rush can't
+report sold out while seats are left. Conference.seatsAvailable is
+rolled up from the pools by a coalescing task for listings & queries;
+getConference sums the pools.
+
+Conferences created before pools existed have seatShards == 0 and keep
+their seats on the Conference entity itself.
+
+"""
+
+import random
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import SeatShard
+
+NUM_SEAT_SHARDS = 20    # plus the Conference: within the 25 groups of
+                        # a cross-group transaction
+MIN_SEATS_PER_SHARD = 5
+MAX_RESERVE_ATTEMPTS = 5
+SYNC_INTERVAL = 10 # seconds between seatsAvailable roll-ups
+
+
+class PoolExhausted(Exception):
+    """PoolExhausted -- the chosen pool ran out of seats; pick another"""
+
+
+def shardKeys(conf):
+    """Return the keys of all seat pools of conf."""
+    path = '/'.join(str(part) for part in conf.key.flat())
+    return [ndb.Key(SeatShard, '%s-%d' % (path, i)) for i in range(conf.seatShards)]
+
+
+def createPools(conf, seats):
+    """Set up conf's pools holding seats in total; return the SeatShard
+    entities to write along with conf."""
+    conf.seatShards = max(1, min(NUM_SEAT_SHARDS, seats // MIN_SEATS_PER_SHARD))
+    base, extra = divmod(seats, conf.seatShards)
+    return [SeatShard(key=key, seatsAvailable=base + (1 if i < extra else 0))
+        for i, key in enumerate(shardKeys(conf))]
+
+
+@ndb.transactional(xg=True)
+def putWithPools(conf, pools):
+    """Write a new conf and its pools from createPools() together, so a
+    failure can't leave the conference without its seats."""
+    ndb.put_multi([conf] + pools)
+
+
+@ndb.tasklet
+def availableAsync(conf):
+    """Return (future of) the number of free seats of conf."""
+    if not conf.seatShards:
+        raise ndb.Return(conf.seatsAvailable)
+    pools = yield ndb.get_multi_async(shardKeys(conf), use_cache=False)
+    raise ndb.Return(sum(pool.seatsAvailable for pool in pools if pool))
+
+
+def available(conf):
+    """Return the number of free seats of conf."""
+    return availableAsync(conf).get_result()
+
+
+@ndb.tasklet
+def pickShardAsync(conf, reg=True):
+    """Choose the pool a (un)registration should use.
+
+    Returns (future of) (pool key, free seats before the change); the
+    key is None when registering and every pool is empty. The pools are
+    read outside any transaction, so the caller must re-check the chosen
+    pool inside its own transaction and retry on PoolExhausted.
+    """
+    keys = shardKeys(conf)
+    # bypass the context cache; a retry must see what the last
+    # transaction committed
+    pools = yield ndb.get_multi_async(keys, use_cache=False)
+    free = sum(pool.seatsAvailable for pool in pools if pool)
+    if not reg:
+        raise ndb.Return((random.choice(keys), free))
+    candidates = [key for key, pool in zip(keys, pools)
+        if pool and pool.seatsAvailable > 0]
+    if not candidates:
+        raise ndb.Return((None, free))
+    raise ndb.Return((random.choice(candidates), free))
+
+
+def pickShard(conf, reg=True):
+    """Synchronous pickShardAsync()."""
+    return pickShardAsync(conf, reg).get_result()
+
+
+@ndb.tasklet
+def nonEmptyPoolsAsync(conf):
+    """Return (future of) (keys of the pools with free seats, in pool
+    order, free seats in all pools), read afresh; the fallback once
+    MAX_RESERVE_ATTEMPTS random picks lost to other registrants."""
+    keys = shardKeys(conf)
+    pools = yield ndb.get_multi_async(keys, use_cache=False)
+    free = sum(pool.seatsAvailable for pool in pools if pool)
+    raise ndb.Return(([key for key, pool in zip(keys, pools)
+        if pool and pool.seatsAvailable > 0], free))
+
+
+def nonEmptyPools(conf):
+    """Synchronous nonEmptyPoolsAsync()."""
+    return nonEmptyPoolsAsync(conf).get_result()
+
+
+@ndb.tasklet
+def _adjustAsync(pool_key, delta):
+    """Add delta to one pool (SeatShard or legacy Conference); must run
+    in a transaction. Return the pool's free seats before, or None if
+    it does not have enough."""
+    pool = yield pool_key.get_async()
+    if pool is None:
+        if pool_key.kind() != SeatShard._get_kind():
+            raise ndb.Return(None)
+        pool = SeatShard(key=pool_key)
+    before = pool.seatsAvailable or 0
+    if before + delta < 0:
+        raise ndb.Return(None)
+    pool.seatsAvailable = before + delta
+    yield pool.put_async()
+    raise ndb.Return(before)
+
+
+@ndb.tasklet
+def changeAsync(conf, reg=True):
+    """Take (reg) or give back one seat of conf in a transaction of its
+    own, leaving the attendee's Profile to the caller.
+
+    Returns (future of) (done, free seats before the change); done is
+    False when there was no seat left to take.
+    """
+    delta = -1 if reg else 1
+    for attempt in range(MAX_RESERVE_ATTEMPTS):
+        if conf.seatShards:
+            pool_key, free = yield pickShardAsync(conf, reg)
+            if pool_key is None:
+                raise ndb.Return((False, free))
+        else:
+            pool_key, free = conf.key, None
+        before = yield ndb.transaction_async(
+            lambda: _adjustAsync(pool_key, delta))
+        if before is not None:
+            raise ndb.Return((True, before if free is None else free))
+        if not conf.seatShards:
+            raise ndb.Return((False, 0))
+        # other registrants emptied the pool; pick again
+    # still losing the race: try each pool with seats in turn, so
+    # giving up means every pool was empty when we got to it
+    pool_keys, free = yield nonEmptyPoolsAsync(conf)
+    for pool_key in pool_keys:
+        before = yield ndb.transaction_async(
+            lambda: _adjustAsync(pool_key, delta))
+        if before is not None:
+            raise ndb.Return((True, free))
+    raise ndb.Return((False, 0))
+
+
+@ndb.transactional(xg=True)
+def resize(conf, delta):
+    """Add delta (possibly negative) free seats to conf's pools; joins
+    the caller's transaction. Return the new number of free seats, or
+    None when there are not enough free seats to take away.
+    """
+    keys = shardKeys(conf)
+    pools = [pool or SeatShard(key=key)
+        for key, pool in zip(keys, ndb.get_multi(keys))]
+    free = sum(pool.seatsAvailable for pool in pools)
+    if free + delta < 0:
+        return None
+    if delta > 0:
+        pools[0].seatsAvailable += delta
+    remaining = -delta
+    for pool in pools:
+        if remaining <= 0:
+            break
+        taken = min(pool.seatsAvailable, remaining)
+        pool.seatsAvailable -= taken
+        remaining -= taken
+    ndb.put_multi(pools)
+    return free + delta
+
+
+def scheduleSync(conf):
+    """Queue a roll-up of conf's pools into Conference.seatsAvailable;
+    at most one per conference per SYNC_INTERVAL."""
+    bucket = int(time.time() // SYNC_INTERVAL)
+    wsck = conf.key.urlsafe()
+    try:
+        taskqueue.add(params={'wsck': wsck},
+            name='sync-seats-%s-%d' % (wsck, bucket),
+            countdown=SYNC_INTERVAL,
+            url='/tasks/sync_seats'
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        # a roll-up covering this change is already queued
+        pass
+
+
+def sync(c_key):
+    """Write the sum of the pools of Conference c_key into its
+    seatsAvailable; used by the roll-up task."""
+    conf = c_key.get()
+    if not conf or not conf.seatShards:
+        return
+    free = available(conf)
+
+    @ndb.transactional()
+    def _write():
+        conf = c_key.get()
+        conf.seatsAvailable = free
+        conf.put()
+    _write()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""serializers.py
+
+Udacity conference server-side Python App Engine entity to ProtoRPC
+message copying
+
+A Serializer works out once per (model, message) pair which message
+fields are filled from which entity properties, and how each value is
+converted, so copying a page of entities is a loop over that plan
+rather than reflection on every row. A field mask narrows the plan to
+the requested fields, so unrequested ones are neither read from the
+entity nor sent. Properties a projected entity doesn't carry are left
+unset rather than read.
+
+"""
+
+from operator import attrgetter
+
+
+class Serializer(object):
+    """Serializer -- precompiled copy plan from an ndb model to a message"""
+
+    def __init__(self, model, message, convert=None):
+        """Build the plan; convert maps message field names to functions
+        taking the entity and returning the field value. Other fields
+        are copied from the model property of the same name, if any."""
+        convert = convert or {}
+        plan = []
+        for field in message.all_fields():
+            # (field, getter, whether it reads the property of that name)
+            isProperty = field.name in model._properties
+            if field.name in convert:
+                plan.append((field.name, convert[field.name], isProperty))
+            elif isProperty:
+                plan.append((field.name, attrgetter(field.name), True))
+        self.message = message
+        self.plan = tuple(plan)
+        self._masked = {}
+        # only messages with required fields can fail check_initialized()
+        self.check = any(field.required for field in message.all_fields())
+
+    def fieldNames(self):
+        """Return the names of all fields of the message."""
+        return frozenset(field.name for field in self.message.all_fields())
+
+    def _planFor(self, fields):
+        """Return the plan narrowed to field mask fields (a frozenset;
+        None for all fields)."""
+        if fields is None:
+            return self.plan
+        plan = self._masked.get(fields)
+        if plan is None:
+            plan = self._masked[fields] = tuple(
+                entry for entry in self.plan if entry[0] in fields)
+        return plan
+
+    def one(self, entity, fields=None, **overrides):
+        """Return a message for entity with only the fields in mask
+        fields, if given; overrides set fields verbatim."""
+        msg = self.message()
+        projected = entity._projection
+        for name, get, isProperty in self._planFor(fields):
+            if name in overrides:
+                continue
+            if projected and isProperty and name not in projected:
+                continue
+            setattr(msg, name, get(entity))
+        for name, value in overrides.items():
+            if fields is None or name in fields:
+                setattr(msg, name, value)
+        if self.check:
+            msg.check_initialized()
+        return msg
+
+    def many(self, entities, fields=None):
+        """Return a list of messages, one per entity."""
+        one = self.one
+        return [one(entity, fields) for entity in entities]
@@ -16,3 +16,7 @@ WEB_CLIENT_ID = '324164527376-h80g5a5vq6p20b3se8d8euaf32qkufp2.apps.googleuserco
 ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# Google's OAuth2 tokeninfo endpoint, used by utils.getUserId() for
+# id_type "oauth"; point it at a fake server to test locally.
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo'
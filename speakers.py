@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""speakers.py
+
+Udacity conference server-side Python App Engine speaker directory
+
+Every speaker has a root Speaker entity whose key name is the speaker's
+normalized name (lower case, runs of whitespace collapsed), so "Jane
+Doe" and "jane  doe " are the same speaker. It lists the speaker's
+sessions across all conferences, making a speaker's sessions one get
+plus one get_multi instead of a global property query. Since key names
+sort in order, a prefix search is a range scan of the built-in key
+index.
+
+"""
+
+from google.appengine.ext import ndb
+
+from models import Speaker
+
+MAX_PREFIX_RESULTS = 20
+
+
+def normalize(name):
+    """Return the normalized form of speaker name, '' for no name."""
+    return u' '.join((name or u'').split()).lower()
+
+
+def speakerKey(name):
+    """Return the Speaker key for speaker name, None for no name."""
+    norm = normalize(name)
+    return ndb.Key(Speaker, norm) if norm else None
+
+
+@ndb.transactional(xg=True)
+def addSessions(name, s_keys):
+    """List Session keys s_keys under speaker name (set semantics, so
+    safe to repeat); joins the caller's transaction if any."""
+    key = speakerKey(name)
+    if key is None:
+        return
+    speaker = key.get() or Speaker(key=key, displayName=name.strip())
+    known = set(speaker.sessionKeys)
+    added = [s_key for s_key in s_keys if s_key not in known]
+    if added:
+        speaker.sessionKeys.extend(added)
+        speaker.put()
+
+
+@ndb.tasklet
+def sessionsAsync(name):
+    """Return (future of) (Speaker, its Sessions), or (None, []) for an
+    unknown speaker."""
+    key = speakerKey(name)
+    speaker = (yield key.get_async()) if key else None
+    if speaker is None:
+        raise ndb.Return((None, []))
+    sessions = yield ndb.get_multi_async(speaker.sessionKeys)
+    raise ndb.Return((speaker, [sess for sess in sessions if sess]))
+
+
+def sessions(name):
+    """Synchronous sessionsAsync()."""
+    return sessionsAsync(name).get_result()
+
+
+def search(prefix, limit=MAX_PREFIX_RESULTS):
+    """Return up to limit Speakers whose normalized name starts with
+    prefix, in name order."""
+    norm = normalize(prefix)
+    q = Speaker.query()
+    if norm:
+        q = q.filter(Speaker.key >= ndb.Key(Speaker, norm)).\
+            filter(Speaker.key < ndb.Key(Speaker, norm + u'\ufffd'))
+    return q.order(Speaker.key).fetch(min(limit, MAX_PREFIX_RESULTS))
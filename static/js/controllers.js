@@ -259,6 +259,12 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
 
     $scope.selectedTab = 'ALL';
 
+    /**
+     * The conference fields the list shows; the API leaves out the rest.
+     * @type {string}
+     */
+    var LIST_FIELDS = 'websafeKey,name,city,startDate,organizerDisplayName,maxAttendees,seatsAvailable';
+
     /**
      * Holds the filters that will be applied when queryConferencesAll is invoked.
      * @type {Array}
@@ -423,12 +429,25 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         }
     };
 
+    /**
+     * Holds the cursor for the next page of the 'ALL' tab, if there is one.
+     * @type {string}
+     */
+    $scope.nextCursor = null;
+
     /**
      * Invokes the conference.queryConferences API.
+     *
+     * @param loadMore if true, fetches the next page and appends it to the conferences already shown.
      */
-    $scope.queryConferencesAll = function () {
+    $scope.queryConferencesAll = function (loadMore) {
         var sendFilters = {
-            filters: []
+            filters: [],
+            pageSize: $scope.pagination.pageSize,
+            fieldMask: LIST_FIELDS
+        }
+        if (loadMore && $scope.nextCursor) {
+            sendFilters.cursor = $scope.nextCursor;
         }
         for (var i = 0; i < $scope.filters.length; i++) {
             var filter = $scope.filters[i];
@@ -458,22 +477,33 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
+                        if (!loadMore) {
+                            $scope.conferences = [];
+                            $scope.pagination.currentPage = 0;
+                        }
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        $scope.nextCursor = resp.nextCursor || null;
                     }
                     $scope.submitted = true;
                 });
             });
     }
 
+    /**
+     * Fetches the next page of conferences for the 'ALL' tab.
+     */
+    $scope.loadMoreConferences = function () {
+        $scope.queryConferencesAll(true);
+    };
+
     /**
      * Invokes the conference.getConferencesCreated method.
      */
     $scope.getConferencesCreated = function () {
         $scope.loading = true;
-        gapi.client.conference.getConferencesCreated().
+        gapi.client.conference.getConferencesCreated({fieldMask: LIST_FIELDS}).
             execute(function (resp) {
                 $scope.$apply(function () {
                     $scope.loading = false;
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+"""test_query_paging.py
+
+queryConferences paging with the same filters in different orders,
+where the first page comes from the query cache. Needs the App Engine
+SDK:
+
+    APPENGINE_SDK=~/google_appengine python -m unittest tests.test_query_paging
+
+"""
+
+import unittest
+
+from benchmarks import stubs
+
+PAGE_SIZE = 3
+
+
+class FilterOrderPagingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = stubs.setup()
+        from google.appengine.ext import ndb
+        from models import Conference
+        from models import Profile
+        p_key = ndb.Key(Profile, 'organizer')
+        ndb.put_multi([Conference(parent=p_key, name='Conference %02d' % i,
+                city='London' if i % 2 else 'Paris', maxAttendees=10 * i,
+                organizerUserId='organizer', organizerDisplayName='Organizer')
+            for i in range(20)])
+        self.expected = sorted('Conference %02d' % i for i in range(20)
+            if i % 2 and 10 * i > 50)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _names(self, triples):
+        """Page through queryConferences; return the names found."""
+        from conference import ConferenceApi
+        from models import ConferenceQueryForm
+        from models import ConferenceQueryForms
+        filters = [ConferenceQueryForm(field=field, operator=op, value=value)
+            for field, op, value in triples]
+        names, cursor = [], None
+        for page in range(10):
+            forms = ConferenceApi().queryConferences(ConferenceQueryForms(
+                filters=filters, pageSize=PAGE_SIZE, cursor=cursor))
+            names.extend(form.name for form in forms.items)
+            cursor = forms.nextCursor
+            if not cursor:
+                return names
+        self.fail('Paging did not end.')
+
+    def testOrderAndDuplicates(self):
+        city = ('CITY', 'EQ', 'London')
+        seats = ('MAX_ATTENDEES', 'GT', '50')
+        # the later orders get the first page, and its cursor, from
+        # the cache filled by the first
+        self.assertEqual(self._names([city, seats]), self.expected)
+        self.assertEqual(self._names([seats, city]), self.expected)
+        self.assertEqual(self._names([seats, city, seats]), self.expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
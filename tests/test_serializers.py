@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""test_serializers.py
+
+Serializer plans against projected entities. Needs the App Engine SDK:
+
+    APPENGINE_SDK=~/google_appengine python -m unittest tests.test_serializers
+
+"""
+
+import datetime
+import unittest
+
+from benchmarks import stubs
+
+# the list view's mask, as sent by static/js/controllers.js
+LIST_FIELDS = frozenset(['websafeKey', 'name', 'city', 'startDate',
+    'organizerDisplayName', 'maxAttendees', 'seatsAvailable'])
+
+
+class ProjectedConferenceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = stubs.setup()
+        from google.appengine.ext import ndb
+        from models import Conference
+        from models import Profile
+        self.conf = Conference(parent=ndb.Key(Profile, 'organizer'),
+            name='Projected', description='not projected', city='London',
+            startDate=datetime.date(2016, 5, 1), month=5,
+            endDate=datetime.date(2016, 5, 2), maxAttendees=100,
+            seatsAvailable=100, organizerUserId='organizer',
+            organizerDisplayName='Organizer')
+        self.conf.put()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _projected(self):
+        from conference import CONFERENCE_LIST_PROJECTION
+        from models import Conference
+        confs = Conference.query().fetch(projection=CONFERENCE_LIST_PROJECTION)
+        self.assertEqual(len(confs), 1)
+        return confs[0]
+
+    def testListMask(self):
+        from conference import ConferenceApi
+        forms = ConferenceApi()._copyConferencesToFormsAsync(
+            [self._projected()], LIST_FIELDS).get_result()
+        form = forms.items[0]
+        self.assertEqual(form.websafeKey, self.conf.key.urlsafe())
+        self.assertEqual(form.name, 'Projected')
+        self.assertEqual(form.city, 'London')
+        self.assertEqual(form.startDate, '2016-05-01')
+        self.assertEqual(form.organizerDisplayName, 'Organizer')
+        self.assertEqual(form.maxAttendees, 100)
+        self.assertEqual(form.seatsAvailable, 100)
+        self.assertEqual(form.description, None)
+
+    def testUnprojectedFieldsLeftUnset(self):
+        from conference import CONFERENCE_SERIALIZER
+        form = CONFERENCE_SERIALIZER.one(self._projected())
+        self.assertEqual(form.name, 'Projected')
+        self.assertEqual(form.description, None)
+        self.assertEqual(form.topics, [])
+
+    def testOverrideNotRead(self):
+        from conference import CONFERENCE_SERIALIZER
+        conf = self._projected()
+        conf.organizerDisplayName = None
+        form = CONFERENCE_SERIALIZER.one(conf, LIST_FIELDS,
+            organizerDisplayName='From Profile')
+        self.assertEqual(form.organizerDisplayName, 'From Profile')
+
+
+if __name__ == '__main__':
+    unittest.main()
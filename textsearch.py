@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+"""textsearch.py
+
+Udacity conference server-side Python App Engine full-text search
+
+Conferences and sessions are mirrored as documents in two Search API
+indexes, with the websafe entity key as document id. Documents are
+written after the datastore write has committed; if the Search API
+fails, a task retries the indexing from the datastore, so the indexes
+catch up rather than the write failing. A query returns the matching
+keys, best match first, plus a cursor for the next page.
+
+"""
+
+import logging
+
+from google.appengine.api import search
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Session
+
+CONFERENCE_INDEX = 'conferences'
+SESSION_INDEX = 'sessions'
+MAX_PUT_DOCUMENTS = 200 # Search API limit per put()
+SCORE_LIMIT = 1000      # matches ranked per query
+
+
+def _text(value):
+    """Return value, or '' for None (fields may not be None)."""
+    return value or u''
+
+
+def _conferenceDocument(conf):
+    """Return the search Document of Conference conf."""
+    fields = [
+        search.TextField(name='name', value=_text(conf.name)),
+        search.TextField(name='description', value=_text(conf.description)),
+        search.TextField(name='topics', value=u' '.join(conf.topics or [])),
+        search.TextField(name='city', value=_text(conf.city)),
+        search.AtomField(name='organizer', value=conf.organizerUserId),
+    ]
+    if conf.startDate:
+        fields.append(search.DateField(name='startDate', value=conf.startDate))
+    return search.Document(doc_id=conf.key.urlsafe(), fields=fields)
+
+
+def _sessionDocument(sess):
+    """Return the search Document of Session sess."""
+    fields = [
+        search.TextField(name='name', value=_text(sess.name)),
+        search.TextField(name='highlights', value=_text(sess.highlights)),
+        search.TextField(name='speaker', value=_text(sess.speaker)),
+        search.TextField(name='typeOfSession', value=_text(sess.typeOfSession)),
+        search.AtomField(name='wsck', value=sess.wsck),
+    ]
+    if sess.date:
+        fields.append(search.DateField(name='date', value=sess.date))
+    return search.Document(doc_id=sess.key.urlsafe(), fields=fields)
+
+
+_DOCUMENTS = {
+    Conference._get_kind(): (CONFERENCE_INDEX, _conferenceDocument),
+    Session._get_kind(): (SESSION_INDEX, _sessionDocument),
+}
+
+
+def index(entities):
+    """Write the search documents of Conferences and/or Sessions; on a
+    Search API failure, queue indexKeys() for them instead."""
+    batches = {}
+    for entity in entities:
+        index_name, document = _DOCUMENTS[entity.key.kind()]
+        batches.setdefault(index_name, []).append(document(entity))
+    for index_name, docs in batches.items():
+        for start in range(0, len(docs), MAX_PUT_DOCUMENTS):
+            batch = docs[start:start + MAX_PUT_DOCUMENTS]
+            try:
+                search.Index(name=index_name).put(batch)
+            except search.Error:
+                logging.exception('Indexing failed; queued for retry')
+                taskqueue.add(params={'key': [doc.doc_id for doc in batch]},
+                    url='/tasks/index_search'
+                )
+
+
+def indexKeys(keys):
+    """(Re)index the entities with the given keys from the datastore,
+    removing the documents of those that no longer exist."""
+    entities = ndb.get_multi(keys)
+    index([entity for entity in entities if entity])
+    gone = {}
+    for key, entity in zip(keys, entities):
+        if entity is None:
+            index_name = _DOCUMENTS[key.kind()][0]
+            gone.setdefault(index_name, []).append(key.urlsafe())
+    for index_name, doc_ids in gone.items():
+        search.Index(name=index_name).delete(doc_ids)
+
+
+def query(index_name, query_string, limit, cursor=None):
+    """Run a ranked keyword query on index_name.
+
+    Returns (entity keys, websafe cursor of the next page or None).
+    Raises search.QueryError for a malformed query and ValueError for
+    a bad cursor.
+    """
+    options = search.QueryOptions(
+        limit=limit,
+        ids_only=True,
+        cursor=search.Cursor(web_safe_string=cursor),
+        sort_options=search.SortOptions(
+            match_scorer=search.MatchScorer(),
+            expressions=[search.SortExpression(expression='_score',
+                direction=search.SortExpression.DESCENDING,
+                default_value=0)],
+            limit=SCORE_LIMIT))
+    results = search.Index(name=index_name).search(
+        search.Query(query_string=query_string, options=options))
+    keys = [ndb.Key(urlsafe=doc.doc_id) for doc in results.results]
+    next_cursor = results.cursor.web_safe_string if results.cursor else None
+    return keys, next_cursor
@@ -1,10 +1,125 @@
+import collections
+import hashlib
 import json
 import os
+import threading
 import time
 import uuid
 
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
 from models import Profile
+import settings
+
+# token -> user id cache: a per-instance LRU in front of memcache. A
+# token is cached until shortly before it expires; a token tokeninfo
+# rejects is cached as '' for a short while, so a client retrying a bad
+# token doesn't cost a fetch per request.
+TOKEN_CACHE_SIZE = 1000
+TOKEN_KEY = 'TOKENINFO_%s'
+TOKEN_EXPIRY_MARGIN = 30        # seconds before expiry we stop trusting it
+TOKEN_DEFAULT_TTL = 5 * 60      # when tokeninfo doesn't say
+TOKEN_MAX_TTL = 60 * 60
+INVALID_TOKEN_TTL = 60
+
+
+class TokenCache(object):
+    """TokenCache -- thread-safe LRU of token -> (user id, expiry time)"""
+
+    def __init__(self, size=TOKEN_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        # local & memcache count all hits, negativeHits those of them
+        # that were cached invalid answers; fetched, invalid and
+        # unreachable split the tokeninfo lookups by answer
+        self.stats = {'local': 0, 'memcache': 0, 'negativeHits': 0,
+            'fetched': 0, 'invalid': 0, 'unreachable': 0}
+
+    def get(self, token):
+        """Return the cached user id of token ('' if invalid), or None."""
+        with self._lock:
+            entry = self._entries.pop(token, None)
+            if entry is None or entry[1] <= time.time():
+                return None
+            self._entries[token] = entry
+            return entry[0]
+
+    def put(self, token, user_id, ttl):
+        with self._lock:
+            self._entries.pop(token, None)
+            self._entries[token] = (user_id, time.time() + ttl)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def count(self, tier):
+        with self._lock:
+            self.stats[tier] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for tier in self.stats:
+                self.stats[tier] = 0
+
+
+tokenCache = TokenCache()
+
+
+def _fetchTokenInfo(token, token_type):
+    """Ask tokeninfo about token. Return (user id, seconds the answer
+    may be cached for); ('', INVALID_TOKEN_TTL) for a rejected token and
+    ('', 0) if tokeninfo couldn't be reached."""
+    url = '%s?%s=%s' % (settings.TOKENINFO_URL, token_type, token)
+    wait = 1
+    for i in range(3):
+        resp = urlfetch.fetch(url)
+        if resp.status_code == 200:
+            info = json.loads(resp.content)
+            ttl = int(info.get('expires_in', TOKEN_DEFAULT_TTL))
+            ttl = min(ttl - TOKEN_EXPIRY_MARGIN, TOKEN_MAX_TTL)
+            return info.get('user_id', ''), max(ttl, 0)
+        elif resp.status_code == 400 and 'invalid_token' in resp.content:
+            if token_type == 'access_token':
+                return '', INVALID_TOKEN_TTL
+            url = '%s?%s=%s' % (settings.TOKENINFO_URL, 'access_token', token)
+            token_type = 'access_token'
+        else:
+            time.sleep(wait)
+            wait = wait + i
+    return '', 0
+
+
+def _oauthUserId(token, token_type):
+    """Return the user id of token from the LRU, memcache or tokeninfo,
+    in that order; '' for an invalid token."""
+    user_id = tokenCache.get(token)
+    if user_id is not None:
+        tokenCache.count('local')
+        if not user_id:
+            tokenCache.count('negativeHits')
+        return user_id
+    # don't put bearer tokens in memcache keys
+    key = TOKEN_KEY % hashlib.sha1(token).hexdigest()
+    cached = memcache.get(key)
+    if cached is not None:
+        user_id, expires = cached
+        if expires > time.time():
+            tokenCache.count('memcache')
+            if not user_id:
+                tokenCache.count('negativeHits')
+            tokenCache.put(token, user_id, expires - time.time())
+            return user_id
+    user_id, ttl = _fetchTokenInfo(token, token_type)
+    if user_id:
+        tokenCache.count('fetched')
+    else:
+        tokenCache.count('invalid' if ttl else 'unreachable')
+    if ttl:
+        tokenCache.put(token, user_id, ttl)
+        memcache.set(key, (user_id, time.time() + ttl), time=ttl)
+    return user_id
+
 
 def getUserId(user, id_type="email"):
     if id_type == "email":
@@ -17,22 +132,7 @@ def getUserId(user, id_type="email"):
         token_type = 'id_token'
         if 'OAUTH_USER_ID' in os.environ:
             token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        return _oauthUserId(token, token_type)
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm